@@ -0,0 +1,66 @@
+"""
+Compares full and partial parsing of saved RemyWiki pages.
+
+Pages are read from the RemyWiki page cache (data/remywiki/*.body) unless
+other files are given.
+
+Usage:
+    python -m benchmarks.remy_parse
+    python -m benchmarks.remy_parse --repeat 20 saved/MAX_300.html saved/Gallery.html
+"""
+
+import argparse
+import glob
+import os
+import statistics
+import time
+
+from bots.remy import extract_page
+from settings import Settings
+
+
+def time_parse(html, partial, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        extract_page(html, partial=partial)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument("pages", nargs="*", help="saved HTML pages")
+    parser.add_argument("--repeat", type=int, default=10, help="parses per page and mode")
+    args = parser.parse_args()
+
+    data_dir = Settings.from_env().data_dir
+    paths = args.pages or sorted(glob.glob(os.path.join(data_dir, "remywiki", "*.body")))
+    if not paths:
+        parser.error("No saved pages found. Run some !jacket commands first or pass pages in")
+
+    totals = {"full": 0.0, "partial": 0.0}
+    print(f"{'page':<40} {'KB':>7} {'full ms':>9} {'partial ms':>11} {'speedup':>8}")
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            html = f.read()
+        if extract_page(html, partial=False) != extract_page(html, partial=True):
+            print(f"WARNING: partial parse of {path} does not match the full parse")
+        full = time_parse(html, False, args.repeat)
+        partial = time_parse(html, True, args.repeat)
+        totals["full"] += full
+        totals["partial"] += partial
+        print(
+            f"{os.path.basename(path)[:40]:<40} {len(html) / 1024:>7.0f} "
+            + f"{full * 1000:>9.1f} {partial * 1000:>11.1f} {full / partial:>7.1f}x"
+        )
+    print(
+        f"{'total':<40} {'':>7} {totals['full'] * 1000:>9.1f} "
+        + f"{totals['partial'] * 1000:>11.1f} {totals['full'] / totals['partial']:>7.1f}x"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Measures rival code storage throughput and latency for each backend.
+
+A scratch table is bulk loaded with --rows entries, then every operation
+runs --ops times, spread over --threads threads, straight against the
+backend (the models' caches are skipped). The table is dropped afterwards.
+Postgres is configured like the bot, from the environment.
+
+Usage:
+    python -m benchmarks.storage_bench
+    python -m benchmarks.storage_bench --backend sqlite postgres --rows 100000 --threads 4
+"""
+
+import argparse
+import random
+import re
+import statistics
+import string
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import storage
+from settings import Settings
+
+# Game the scratch codes are stored under
+GAME = "bench"
+RANKS = [f"{number}DAN" for number in range(1, 11)] + [f"{number}KYU" for number in range(1, 11)] + ["CHUU", "KAI"]
+
+
+def random_entry(rng, user_id):
+    name = "".join(rng.choices(string.ascii_uppercase, k=rng.randint(3, 8)))
+    code = f"{rng.randint(0, 9999):04d}-{rng.randint(0, 9999):04d}"
+    return user_id, name, code, rng.choice(RANKS + [None])
+
+
+def misspell(rng, name):
+    position = rng.randrange(len(name))
+    return name[:position] + rng.choice(string.ascii_uppercase) + name[position + 1 :]
+
+
+def make_operations(rng, entries, ops):
+    """
+    Builds the calls to time for each operation, as (name, method name, args, kwargs)
+    """
+    sample = [rng.choice(entries) for _ in range(ops)]
+    fresh = [random_entry(rng, f"bench-new-{number}") for number in range(ops)]
+    return {
+        "get": [("get", (entry[0],), {}) for entry in sample],
+        "create": [("create", entry, {}) for entry in fresh],
+        "search prefix": [("search", ({"name": entry[1][:2]},), {"limit": 11}) for entry in sample],
+        "search fuzzy": [("search", ({"name": misspell(rng, entry[1])},), {"limit": 11}) for entry in sample],
+        "search code": [("search", ({"code": entry[2]},), {"limit": 11}) for entry in sample],
+        "search page 2": [("search", ({"rank": entry[3] or "KAI"},), {"limit": 11, "after": entry[1:2] + entry[:1]})
+                          for entry in sample],
+        "update": [("update", (entry[0],), {"rank": rng.choice(RANKS)}) for entry in sample],
+        "delete": [("delete", (entry[0],), {}) for entry in fresh],
+    }
+
+
+def timed(backend, call):
+    method, args, kwargs = call
+    start = time.perf_counter()
+    getattr(backend, method)(GAME, *args, **kwargs)
+    return time.perf_counter() - start
+
+
+def bench_backend(name, backend, args):
+    rng = random.Random(args.seed)
+    backend.drop_table()
+    backend.ensure_schema()
+    try:
+        entries = [random_entry(rng, f"bench-{number}") for number in range(args.rows)]
+        start = time.perf_counter()
+        backend.import_rows(GAME, iter(entries))
+        load = time.perf_counter() - start
+        print(f"\n{name}: loaded {args.rows} rows in {load:.2f}s ({args.rows / load:,.0f} rows/s)")
+        print(f"{'operation':<16} {'ops/s':>10} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+
+        with ThreadPoolExecutor(max_workers=args.threads) as executor:
+            for operation, calls in make_operations(rng, entries, args.ops).items():
+                start = time.perf_counter()
+                timings = list(executor.map(lambda call: timed(backend, call), calls))
+                wall = time.perf_counter() - start
+                percentiles = statistics.quantiles(timings, n=100)
+                print(
+                    f"{operation:<16} {len(calls) / wall:>10,.0f} {percentiles[49] * 1000:>8.2f} "
+                    + f"{percentiles[94] * 1000:>8.2f} {percentiles[98] * 1000:>8.2f}"
+                )
+    finally:
+        backend.drop_table()
+        backend.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--backend", nargs="+", choices=list(storage.BACKENDS), default=["sqlite"])
+    parser.add_argument("--rows", type=int, default=50000, help="entries in the table")
+    parser.add_argument("--ops", type=int, default=2000, help="calls per operation")
+    parser.add_argument("--threads", type=int, default=1, help="threads making calls")
+    parser.add_argument("--table", default="rival_bench", help="scratch table, dropped before and after")
+    parser.add_argument("--sqlite-path", default=":memory:", help="SQLite database file")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    if not re.fullmatch(r"[a-z_][a-z0-9_]*", args.table):
+        parser.error("The table name can only have lowercase letters, numbers and underscores")
+
+    for name in args.backend:
+        if name == "sqlite":
+            backend = storage.SQLiteBackend(args.sqlite_path, table=args.table)
+        else:
+            backend = storage.BACKENDS[name].from_settings(Settings.from_env(), table=args.table)
+        bench_backend(name, backend, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Measures how many messages per second go through Honkbot.on_message.
+
+Messages are random chatter, with a few percent of them firing an easter
+egg, sent to a handful of channels. Sending a response is a no-op and the
+outbox is effectively unlimited, so only the bot's own work is timed. The
+trigger engine is also timed on its own, next to the checks it replaced,
+run one after another.
+
+Usage:
+    python -m benchmarks.triggers_bench
+    python -m benchmarks.triggers_bench --messages 200000 --fire-rate 0.1
+"""
+
+import argparse
+import asyncio
+import logging
+import random
+import re
+import string
+import time
+from types import SimpleNamespace
+
+from bots.honkbot import Honkbot
+from bots.outbox import Outbox
+from bots.triggers import TriggerEngine
+from settings import Settings
+
+FIRING = [
+    "honk honk",
+    "anyone going to izakaya tonight",
+    "is a dygma any good",
+    "she put a banana on my car till i noticed",
+]
+
+
+def sequential_checks(content):
+    # What eastereggs did before the trigger engine
+    fired = []
+    if "honk" in content.lower():
+        fired.append("honk")
+    if re.search(r"(^|\s)izakaya($|\s.*$)", content.lower()):
+        fired.append("izakaya")
+    if "dygma" in content.lower():
+        fired.append("dygma")
+    if re.search(r"(s?he|they)\s.+\son\smy\s.+\still?\si", content.lower()):
+        fired.append("buzzer")
+    return fired
+
+
+async def send(content):
+    pass
+
+
+def make_messages(rng, count, fire_rate, channels):
+    words = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 9))) for _ in range(2000)]
+    guild = SimpleNamespace(id=1)
+    channel_list = [SimpleNamespace(id=number, send=send) for number in range(channels)]
+    author = SimpleNamespace(bot=False, display_name="Tester")
+    messages = []
+    for _ in range(count):
+        if rng.random() < fire_rate:
+            content = rng.choice(FIRING)
+        else:
+            content = " ".join(rng.choices(words, k=rng.randint(1, 30)))
+            if rng.random() < 0.5:
+                content = content.capitalize() + "!"
+        messages.append(SimpleNamespace(content=content, author=author, guild=guild, channel=rng.choice(channel_list)))
+    return messages
+
+
+def rate(count, seconds):
+    return f"{count / seconds:>12,.0f} messages/s"
+
+
+async def bench_on_message(honkbot, messages):
+    start = time.perf_counter()
+    for message in messages:
+        await honkbot.on_message(message)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--fire-rate", type=float, default=0.02, help="share of messages firing an easter egg")
+    parser.add_argument("--channels", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    messages = make_messages(rng, args.messages, args.fire_rate, args.channels)
+    engine = TriggerEngine()
+    for message in messages:
+        expected = sequential_checks(message.content)
+        fired = [trigger.name for trigger in engine.matcher(1, message.channel.id).match(message.content.lower())]
+        if fired != expected:
+            print(f"WARNING: {message.content!r} fired {fired}, the old checks fired {expected}")
+            break
+
+    start = time.perf_counter()
+    for message in messages:
+        sequential_checks(message.content)
+    print(f"{'sequential checks':<20} {rate(len(messages), time.perf_counter() - start)}")
+
+    start = time.perf_counter()
+    for message in messages:
+        engine.responses(message)
+    print(f"{'trigger engine':<20} {rate(len(messages), time.perf_counter() - start)}")
+
+    # Effectively unlimited, so easter eggs are sent as fast as they are queued
+    outbox = Outbox(rate=1e9, burst=len(messages))
+    honkbot = Honkbot(logging.getLogger(__name__), Settings.from_env(), outbox=outbox)
+    print(f"{'on_message':<20} {rate(len(messages), asyncio.run(bench_on_message(honkbot, messages)))}")
+
+
+if __name__ == "__main__":
+    main()
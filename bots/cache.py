@@ -0,0 +1,136 @@
+"""
+Small in-process caches shared by the cogs.
+
+TTLCache is a bounded LRU where every entry has a time to live. An entry
+that is past its ttl but still within its stale window is served right
+away while a background task fetches a fresh copy (stale-while-revalidate).
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Bounded cache with expiring entries
+
+    Args:
+        ttl (float): Seconds an entry is considered fresh
+        stale_ttl (float): Extra seconds a stale entry may be served while it is refreshed
+        maxsize (int): Maximum number of entries before the least recently used is dropped
+    """
+
+    def __init__(self, ttl: float, stale_ttl: float = 0, maxsize: int = 1024):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._pending = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable):
+        return self._lookup(key)[0] is not _MISSING
+
+    def _lookup(self, key: Hashable):
+        # Returns (value, is_fresh). Expired entries are dropped
+        entry = self._entries.get(key)
+        if entry is None:
+            return _MISSING, False
+        value, stored_at = entry
+        age = time.monotonic() - stored_at
+        if age > self.ttl + self.stale_ttl:
+            del self._entries[key]
+            return _MISSING, False
+        self._entries.move_to_end(key)
+        return value, age <= self.ttl
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Gets a fresh value from the cache
+
+        Stale values are treated as missing since nothing will refresh them.
+        """
+        value, fresh = self._lookup(key)
+        if value is _MISSING or not fresh:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        self._entries[key] = (value, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    async def get_or_fetch(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Gets a value from the cache, fetching it if needed
+
+        Concurrent misses for the same key share a single fetch. A stale value
+        is returned immediately and refreshed in the background.
+
+        :param key: cache key
+        :param fetch: coroutine function returning the value to store
+        :return: the cached or fetched value
+        """
+        value, fresh = self._lookup(key)
+        if value is not _MISSING:
+            if fresh:
+                self.hits += 1
+            else:
+                self.stale_hits += 1
+                if key not in self._pending:
+                    task = asyncio.ensure_future(self._refresh(key, fetch))
+                    task.add_done_callback(self._log_refresh_error)
+                    self._pending[key] = task
+            return value
+
+        self.misses += 1
+        if key not in self._pending:
+            self._pending[key] = asyncio.ensure_future(self._refresh(key, fetch))
+        return await asyncio.shield(self._pending[key])
+
+    async def _refresh(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            value = await fetch()
+            self.set(key, value)
+            return value
+        finally:
+            self._pending.pop(key, None)
+
+    @staticmethod
+    def _log_refresh_error(task: asyncio.Future):
+        # Nobody awaits a background refresh, so report failures here and
+        # keep serving the stale value until it expires
+        if not task.cancelled() and task.exception():
+            logger.warning(f"Background cache refresh failed: {task.exception()!r}")
+
+    @property
+    def stats(self) -> dict:
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.stale_hits) / lookups if lookups else 0.0,
+        }
@@ -1,279 +1,351 @@
-import re
+import asyncio
+import logging
 
 import discord
 from discord.ext import commands
 
 import models
+from bots.honkbot import CUSTOM_ROLES
 
+# Rivals shown per page of search results
+SEARCH_PAGE_SIZE = 10
 
-class EamuseRivals(commands.Cog):
+logger = logging.getLogger(__name__)
 
-    @commands.command()
-    async def ddrrival(self, ctx, action=None, *args):
-        """
-        Accesses eAmuse rival data stored by the users
 
-        Actions:
-            create [NAME DDR-CODE [DANRANK (8dan, kai, etc.)]]
-            search [[name=NAME] [code=DDR-CODE] [rank=DANRANK]]
-            update [[name=NAME] [code=DDR-CODE] [rank=DANRANK]]
-            delete
+def rival_search(game, user_id, filters):
+    """
+    Makes the fetch function of a RivalSearchView
 
-        Examples:
-            !ddrrival create SPOOKY 1234-5678 8dan
-            !ddrrival search name=SPOOKY
-            !ddrrival update code=8888-8888 rank=10dan
-            !ddrrival delete
+    :param game: key of the game to search, ie. "ddr"
+    :param user_id: the user searching
+    :param filters: the search filters
+    :return: coroutine function getting up to a page and one more row, after a (name, user_id)
+    """
 
-        """
+    async def fetch(after):
+        async with await models.RivalCode.load(game, user_id) as rivals:
+            return await rivals.asearch(limit=SEARCH_PAGE_SIZE + 1, after=after, **filters)
 
-        actions = ["create", "search", "update", "delete"]
-        if action not in actions:
-            return await ctx.send("Bad action! Use `!help ddrrival` for more information")
+    return fetch
 
-        try:
-            ddrcode = models.DDRCode(ctx.author.name)
-        except Exception as e:
-            return await ctx.send("DDR Rival codes are currently unavailable. Send help!")
-            raise e
 
-        if action == "create":
-            # Some form validation
-            # First two args are required. Third arg is optional
-            if len(args) < 2:
-                return await ctx.send(
-                    "Missing required arguments! Use `!help ddrrival` for more information"
-                )
-            if len(args) >= 2:
-                name = args[0].upper()
-                code = args[1]
-                if len(args) > 2:
-                    rank = args[2].upper()
-                else:
-                    rank = None
+def rival_roster(game, user_ids):
+    """
+    Makes the fetch function of a RivalSearchView listing the codes of a group of users
 
-            # Check to see if entries are valid
-            if not name or len(name) > 8:
-                return await ctx.send("Dancer name must be at most 8 characters!")
-            if not re.search("^[0-9]{4}-[0-9]{4}$", code):
-                return await ctx.send("DDR ID must follow the following format: `####-####`")
-            if rank:
-                if not re.search("^((10|[1-9])(DAN|KYU)|CHUU|KAI)$", rank):
-                    return await ctx.send("Rank is not valid! Options are #dan, #kyu, chuu, or kai")
-
-            # Entries have been validated. Initiate model object and create entry
-            try:
-                ddrcode.create(name=name, code=code, rank=rank)
-            except Exception as e:
-                if "An entry already exists" in str(e):
-                    return await ctx.send(str(e))
-                await ctx.send(f"Cannot create entry for {name}! Send help!")
-                raise e
+    :param game: key of the game to list, ie. "ddr"
+    :param user_ids: the users to list
+    :return: coroutine function getting up to a page and one more row, after a (name, user_id)
+    """
 
-            return await ctx.send(f"Created DDR Rival {name}!")
+    async def fetch(after):
+        return await models.run(models.roster, game, user_ids, limit=SEARCH_PAGE_SIZE + 1, after=after)
 
-        elif action == "search":
-            # Need to have some filters
-            if not args:
-                return await ctx.send("Missing filters! Use `!help ddrrival` for more information")
-            filters = {}
-            # Check to see if each filter is properly formatted
-            for arg in args:
-                arg_filter = arg.split("=")
-                if len(arg_filter) != 2:
-                    return await ctx.send(
-                        "Invalid filters! Use `!help ddrrival` for more information"
-                    )
-                if arg_filter[0] not in ddrcode.AVAILABLE_ATTRIBUTES:
-                    return await ctx.send(
-                        f"Invalid filter {arg_filter[0]}! Use `!help ddrrival` for more information"
-                    )
-                filters[arg_filter[0]] = arg_filter[1]
-            # Search!
-            try:
-                response = ddrcode.search(**filters)
-            except Exception as e:
-                await ctx.send("Cannot search for rivals! Send help!")
-                raise e
+    return fetch
 
-            if not response:
-                return await ctx.send("No rivals found with that filter!")
-            response_text = "\n".join(
-                [f"{item[0]}\t{item[1]}\t{item[2]}\t{item[3]}" for item in response]
-            )
-            return await ctx.send(f"```\n{response_text}\n```")
 
-        elif action == "update":
-            # Need to have some filters
-            if not args:
-                return await ctx.send("Missing filters! Use `!help ddrrival` for more information")
-            filters = {}
-            # Check to see if each filter is properly formatted
-            for arg in args:
-                arg_filter = arg.split("=")
-                if len(arg_filter) != 2:
-                    return await ctx.send(
-                        "Invalid filters! Use `!help ddrrival` for more information"
-                    )
-                if arg_filter[0] not in ddrcode.AVAILABLE_ATTRIBUTES:
-                    return await ctx.send(
-                        f"Invalid filter {arg_filter[0]}! Use `!help ddrrival` for more information"
-                    )
-                filters[arg_filter[0]] = arg_filter[1]
-            # Make the update
-            try:
-                ddrcode.update(**filters)
-            except Exception as e:
-                if "Entry must be created first" in str(e):
-                    return await ctx.send(
-                        "Your entry must be created first. See `!help ddrrival` for more information"
-                    )
-                else:
-                    await ctx.send("Cannot update entry! Send help!")
-                    raise e
-            return await ctx.send("Entry has been updated!")
+class RivalSearchView(discord.ui.View):
+    """
+    Pages through rival search results with Previous and Next buttons
 
-        elif action == "delete":
-            try:
-                ddrcode.delete()
-            except Exception as e:
-                if "Entry must be created first" in str(e):
-                    return await ctx.send(
-                        "Your entry must be created first. See `!help ddrrival` for more information"
-                    )
-                else:
-                    await ctx.send("Cannot delete entry! Send help!")
-                    raise e
-            return await ctx.send("Entry has been deleted!")
+    Pages are fetched when they are shown, each starting after the last
+    rival of the page before it, so only one page is ever loaded.
 
-    @commands.command()
-    async def iidxrival(self, ctx, action=None, *args):
+    Args:
+        author (discord.abc.User): The user who searched, the only one who can turn pages
+        fetch (callable): Coroutine function from rival_search
+    """
+
+    def __init__(self, author, fetch):
+        super().__init__(timeout=120)
+        self.author = author
+        self.fetch = fetch
+        self.starts = [None]
+        self.page = 0
+        self.rows = []
+        self.message = None
+
+    async def show(self, page, rows=None):
+        """
+        Loads a page and updates the buttons for it
+
+        :param page: index of the page, from 0
+        :param rows: the page's rows, if they were already fetched
+        """
+        if rows is None:
+            rows = await self.fetch(self.starts[page])
+        self.page = page
+        self.rows = rows[:SEARCH_PAGE_SIZE]
+        has_more = len(rows) > SEARCH_PAGE_SIZE
+        if has_more and len(self.starts) == page + 1:
+            last = self.rows[-1]
+            self.starts.append((last[1], last[0]))
+        self.previous_page.disabled = page == 0
+        self.next_page.disabled = not has_more
+
+    def render(self):
+        response_text = "\n".join([f"{item[0]}\t{item[1]}\t{item[2]}\t{item[3]}" for item in self.rows])
+        return f"```\n{response_text}\n```Page {self.page + 1}"
+
+    async def send(self, ctx):
+        if self.next_page.disabled:
+            # Everything fit on one page, no need for buttons
+            self.stop()
+            return await ctx.send(self.render())
+        self.message = await ctx.send(self.render(), view=self)
+        return self.message
+
+    async def interaction_check(self, interaction):
+        return interaction.user.id == self.author.id
+
+    @discord.ui.button(label="Previous", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction, button):
+        await self.show(self.page - 1)
+        await interaction.response.edit_message(content=self.render(), view=self)
+
+    @discord.ui.button(label="Next", style=discord.ButtonStyle.primary)
+    async def next_page(self, interaction, button):
+        await self.show(self.page + 1)
+        await interaction.response.edit_message(content=self.render(), view=self)
+
+    async def on_timeout(self):
+        if self.message:
+            for item in self.children:
+                item.disabled = True
+            await self.message.edit(view=self)
+
+
+class EamuseRivals(commands.Cog):
+
+    async def cog_load(self):
+        self._schema_task = asyncio.ensure_future(self.ensure_schema())
+
+    async def cog_unload(self):
+        self._schema_task.cancel()
+
+    async def ensure_schema(self):
+        try:
+            await models.run(models.ensure_schema)
+        except Exception as e:
+            logger.warning(f"Could not create the rival search indexes: {e!r}")
+
+    @commands.command(aliases=[f"{key}rival" for key in models.GAMES])
+    async def rivals(self, ctx, action=None, *args):
         """
         Accesses eAmuse rival data stored by the users
 
+        !rivals shows every code you have. !ddrrival, !iidxrival, or
+        !rivals GAME, manage and search the codes of a game.
+
         Actions:
-            create [NAME IIDX-CODE [DANRANK (8dan, kai, etc.)]]
-            search [[name=NAME] [code=IIDX-CODE] [rank=DANRANK]]
-            update [[name=NAME] [code=IIDX-CODE] [rank=DANRANK]]
+            create [NAME CODE [DANRANK (8dan, kai, etc.)]]
+            search [[name=NAME] [code=CODE] [rank=DANRANK]]
+            update [[name=NAME] [code=CODE] [rank=DANRANK]]
             delete
 
         Examples:
-            !iidxrival create SPOOKY 1234-5678 8dan
+            !rivals
+            !ddrrival create SPOOKY 1234-5678 8dan
             !iidxrival search name=SPOOKY
-            !iidxrival update code=8888-8888 rank=10dan
-            !iidxrival delete
+            !rivals ddr update code=8888-8888 rank=10dan
+            !ddrrival delete
 
         """
 
+        invoked_with = ctx.invoked_with.lower()
+        if invoked_with.endswith("rival") and invoked_with[: -len("rival")] in models.GAMES:
+            game = models.GAMES[invoked_with[: -len("rival")]]
+        elif action is None:
+            return await self.show_user_codes(ctx)
+        elif action.lower() in models.GAMES:
+            game = models.GAMES[action.lower()]
+            action, args = (args[0], args[1:]) if args else (None, ())
+        else:
+            return await ctx.send(f"Bad game! Options are {', '.join(models.GAMES)}")
+        await self.rival_action(ctx, game, action, args)
+
+    async def show_user_codes(self, ctx):
+        try:
+            codes = await models.run(models.user_codes, ctx.author.name)
+        except Exception as e:
+            await ctx.send("Rival codes are currently unavailable. Send help!")
+            raise e
+        if not codes:
+            return await ctx.send("You have no rival codes yet! Use `!help rivals` for more information")
+        lines = [f"{models.GAMES[game].title if game in models.GAMES else game}\t{name}\t{code}\t{rank or ''}"
+                 for game, name, code, rank in codes]
+        return await ctx.send("```\n" + "\n".join(lines) + "\n```")
+
+    @staticmethod
+    def parse_filters(args, attributes):
+        """
+        Reads key=value arguments
+
+        :param args: the command arguments
+        :param attributes: the keys allowed
+        :return: tuple of the filters and the argument that is not valid, if there is one
+        """
+        filters = {}
+        for arg in args:
+            arg_filter = arg.split("=")
+            if len(arg_filter) != 2 or arg_filter[0] not in attributes:
+                return filters, arg
+            filters[arg_filter[0]] = arg_filter[1]
+        return filters, None
+
+    async def rival_action(self, ctx, game, action, args):
+        """
+        Runs a rival action on the author's code of a game
+
+        :param ctx: the command context
+        :param game: the models.Game to act on
+        :param action: create, search, update, or delete
+        :param args: the action's arguments
+        """
+        help_hint = f"Use `!help {ctx.invoked_with}` for more information"
         actions = ["create", "search", "update", "delete"]
         if action not in actions:
-            return await ctx.send("Bad action! Use `!help iidxrival` for more information")
+            return await ctx.send(f"Bad action! {help_hint}")
 
         try:
-            iidxcode = models.IIDXCode(ctx.author.name)
+            rivalcode = await models.RivalCode.load(game.key, ctx.author.name)
         except Exception as e:
-            return await ctx.send("IIDX Rival codes are currently unavailable. Send help!")
+            await ctx.send(f"{game.title} Rival codes are currently unavailable. Send help!")
             raise e
 
         if action == "create":
             # Some form validation
             # First two args are required. Third arg is optional
             if len(args) < 2:
-                return await ctx.send(
-                    "Missing required arguments! Use `!help iidxrival` for more information"
-                )
-            if len(args) >= 2:
-                name = args[0].upper()
-                code = args[1]
-                if len(args) > 2:
-                    rank = args[2].upper()
-                else:
-                    rank = None
+                return await ctx.send(f"Missing required arguments! {help_hint}")
+            name = args[0].upper()
+            code = args[1]
+            rank = args[2].upper() if len(args) > 2 else None
 
             # Check to see if entries are valid
-            if not name or len(name) > 6:
-                return await ctx.send("DJ name must be at most 6 characters!")
-            if not re.search("^[0-9]{4}-[0-9]{4}$", code):
-                return await ctx.send("IIDX ID must follow the following format: `####-####`")
-            if rank:
-                if not re.search("^((10|[1-9])(DAN|KYU)|CHUU|KAI)$", rank):
-                    return await ctx.send("Rank is not valid! Options are #dan, #kyu, chuu, or kai")
-
-            # Entries have been validated. Initiate model object and create entry
-            try:
-                iidxcode.create(name=name, code=code, rank=rank)
-            except Exception as e:
-                if "An entry already exists" in str(e):
-                    return await ctx.send(str(e))
-                await ctx.send(f"Cannot create entry for {name}! Send help!")
-                raise e
+            error = game.validate(name, code, rank)
+            if error:
+                return await ctx.send(error)
 
-            return await ctx.send(f"Created IIDx Rival {name}!")
-
-        elif action == "search":
+        # Search and update need some filters
+        if action in ("search", "update"):
             if not args:
-                return await ctx.send("Missing filters! Use `!help iidxrival` for more information")
-            filters = {}
-            for arg in args:
-                arg_filter = arg.split("=")
-                if len(arg_filter) != 2:
-                    return await ctx.send(
-                        "Invalid filters! Use `!help iidxrival` for more information"
-                    )
-                if arg_filter[0] not in iidxcode.AVAILABLE_ATTRIBUTES:
-                    return await ctx.send(
-                        f"Invalid filter {arg_filter[0]}! Use `!help iidxrival` for more information"
-                    )
-                filters[arg_filter[0]] = arg_filter[1]
-
+                return await ctx.send(f"Missing filters! {help_hint}")
+            filters, invalid = self.parse_filters(args, rivalcode.AVAILABLE_ATTRIBUTES)
+            if invalid is not None:
+                if len(invalid.split("=")) == 2:
+                    return await ctx.send(f"Invalid filter {invalid.split('=')[0]}! {help_hint}")
+                return await ctx.send(f"Invalid filters! {help_hint}")
+
+        if action == "update" and rivalcode.code is not None:
+            # Check the entry as it will be after the update
+            values = {key: getattr(rivalcode, key) for key in rivalcode.AVAILABLE_ATTRIBUTES}
+            values.update({key: value.upper() for key, value in filters.items()})
+            error = game.validate(values["name"], values["code"], values["rank"])
+            if error:
+                return await ctx.send(error)
+
+        # The database work is done and the model let go before replying,
+        # so nothing is held while Discord is slow
+        response = None
+        failure = None
+        async with rivalcode:
             try:
-                response = iidxcode.search(**filters)
+                if action == "create":
+                    await rivalcode.acreate(name=name, code=code, rank=rank)
+                elif action == "search":
+                    response = await rivalcode.asearch(limit=SEARCH_PAGE_SIZE + 1, **filters)
+                elif action == "update":
+                    await rivalcode.aupdate(**filters)
+                else:
+                    await rivalcode.adelete()
             except Exception as e:
+                failure = e
+
+        if failure is not None:
+            if "An entry already exists" in str(failure):
+                return await ctx.send(str(failure))
+            if "Entry must be created first" in str(failure):
+                return await ctx.send(
+                    f"Your entry must be created first. See `!help {ctx.invoked_with}` for more information"
+                )
+            if action == "create":
+                await ctx.send(f"Cannot create entry for {name}! Send help!")
+            elif action == "search":
                 await ctx.send("Cannot search for rivals! Send help!")
-                raise e
+            else:
+                await ctx.send(f"Cannot {action} entry! Send help!")
+            raise failure
+
+        if action == "create":
+            return await ctx.send(f"Created {game.title} Rival {name}!")
+        if action == "search":
             if not response:
                 return await ctx.send("No rivals found with that filter!")
-            response_text = "\n".join(
-                [f"{item[0]}\t{item[1]}\t{item[2]}\t{item[3]}" for item in response]
-            )
-            return await ctx.send(f"```\n{response_text}\n```")
+            view = RivalSearchView(ctx.author, rival_search(game.key, ctx.author.name, filters))
+            await view.show(0, response)
+            return await view.send(ctx)
+        return await ctx.send(f"Entry has been {action}d!")
 
-        elif action == "update":
-            if not args:
-                return await ctx.send("Missing filters! Use `!help iidxrival` for more information")
-            filters = {}
-            for arg in args:
-                arg_filter = arg.split("=")
-                if len(arg_filter) != 2:
-                    return await ctx.send(
-                        "Invalid filters! Use `!help iidxrival` for more information"
-                    )
-                if arg_filter[0] not in iidxcode.AVAILABLE_ATTRIBUTES:
-                    return await ctx.send(
-                        f"Invalid filter {arg_filter[0]}! Use `!help iidxrival` for more information"
-                    )
-                filters[arg_filter[0]] = arg_filter[1]
-            try:
-                iidxcode.update(**filters)
-            except Exception as e:
-                if "Entry must be created first" in str(e):
-                    return await ctx.send(
-                        "Your entry must be created first. See `!help iidxrival` for more information"
-                    )
-                else:
-                    await ctx.send("Cannot update entry! Send help!")
-                    raise e
-            return await ctx.send("Entry has been updated!")
+    @commands.command()
+    @commands.guild_only()
+    async def roster(self, ctx, region=None, game=None):
+        """
+        Lists the rival codes of everyone in a region
 
-        elif action == "delete":
-            try:
-                iidxcode.delete()
-            except Exception as e:
-                if "Entry must be created first" in str(e):
-                    return await ctx.send(
-                        "Your entry must be created first. See `!help iidxrival` for more information"
-                    )
-                else:
-                    await ctx.send("Cannot delete entry! Send help!")
-                    raise e
-            return await ctx.send("Entry has been deleted!")
+        Regions are the roles from !role, ie. CIN or CLE
+
+        Examples:
+            !roster CIN ddr
+            !roster COL iidx
+
+        """
+
+        regions = {key.lower(): key for key in CUSTOM_ROLES}
+        if not region or region.lower() not in regions:
+            return await ctx.send(f"Bad region! Options are {', '.join(CUSTOM_ROLES)}")
+        if not game or game.lower() not in models.GAMES:
+            return await ctx.send(f"Bad game! Options are {', '.join(models.GAMES)}")
+        region = regions[region.lower()]
+        game = models.GAMES[game.lower()]
+
+        role = discord.utils.get(ctx.guild.roles, name=region)
+        if role is None:
+            return await ctx.send(f"There is no {region} role here!")
+        # Codes are stored by user name, see rivals. Without the members intent
+        # only the members the bot has come across are known
+        user_ids = [member.name for member in role.members]
+        seen = "" if ctx.bot.intents.members else " that I've seen"
+
+        fetch = rival_roster(game.key, user_ids)
+        try:
+            response = await fetch(None)
+        except Exception as e:
+            await ctx.send(f"{game.title} Rival codes are currently unavailable. Send help!")
+            raise e
+        if not response:
+            return await ctx.send(f"No one in {region}{seen} has a {game.title} rival code yet!")
+        if seen:
+            await ctx.send(f"Only listing the people in {region}{seen}. Ask an admin to turn on the members intent")
+        view = RivalSearchView(ctx.author, fetch)
+        await view.show(0, response)
+        return await view.send(ctx)
+
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def rivalstats(self, ctx):
+        """
+        Shows how busy the rival code database is and how often the cache answers
+        """
+        backend = models.get_backend()
+        lines = [f"{type(backend).__name__}:"] + [
+            f"  {name}: {value:.4f}" if isinstance(value, float) else f"  {name}: {value}"
+            for name, value in backend.stats.items()
+        ]
+        lines += [
+            f"{name}: {cache['hits']} hits, {cache['misses']} misses "
+            + f"({cache['hit_rate']:.0%}), {cache['size']} cached"
+            for name, cache in models.cache_stats().items()
+        ]
+        await ctx.send("```\n" + "\n".join(lines) + "\n```")
@@ -0,0 +1,257 @@
+"""
+In-memory fuzzy title matching.
+
+TrigramIndex keeps a posting list of every three character chunk of every
+title, so a query only scores titles that share at least one trigram with
+it. Exact and prefix lookups are answered from a dictionary and a sorted
+list without touching the trigrams at all.
+
+TitleCatalog is a TrigramIndex whose entries are saved to a JSON file, for
+catalogs that are downloaded once and then refreshed in the background.
+"""
+
+import asyncio
+import bisect
+import heapq
+import json
+import os
+import re
+import unicodedata
+from collections import defaultdict
+from typing import Hashable, Iterable, List, Tuple
+
+
+def normalize(title: str) -> str:
+    """
+    Lowercases a title and strips everything but letters, numbers and single spaces
+    """
+    title = unicodedata.normalize("NFKC", title).casefold()
+    title = re.sub(r"[^\w\s]", "", title)
+    return " ".join(title.split())
+
+
+def trigrams(text: str) -> set:
+    padded = f"  {text} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def similarity(first: str, second: str) -> float:
+    """
+    Dice coefficient of the trigrams of two normalized titles, from 0 to 1
+    """
+    first_grams = trigrams(normalize(first))
+    second_grams = trigrams(normalize(second))
+    return 2 * len(first_grams & second_grams) / (len(first_grams) + len(second_grams))
+
+
+class TrigramIndex:
+    """
+    Fuzzy index of titles
+
+    Every key can have several titles (ie. a name and an abbreviation). A
+    lookup returns keys, best match first.
+    """
+
+    def __init__(self):
+        self.titles = {}
+        self._exact = defaultdict(set)
+        self._grams = defaultdict(set)
+        self._gram_counts = {}
+        self._sorted = []
+        self._sorted_dirty = False
+
+    def __len__(self):
+        return len(self.titles)
+
+    def __contains__(self, key: Hashable):
+        return key in self.titles
+
+    def add(self, key: Hashable, *titles: str):
+        """
+        Adds a key under one or more titles, replacing whatever it had before
+        """
+        self.remove(key)
+        self.titles[key] = titles
+        for title in titles:
+            norm = normalize(title)
+            if not norm:
+                continue
+            self._exact[norm].add(key)
+            grams = trigrams(norm)
+            self._gram_counts[(key, norm)] = len(grams)
+            for gram in grams:
+                self._grams[gram].add((key, norm))
+        self._sorted_dirty = True
+
+    def remove(self, key: Hashable):
+        for title in self.titles.pop(key, ()):
+            norm = normalize(title)
+            self._exact[norm].discard(key)
+            if not self._exact[norm]:
+                del self._exact[norm]
+            for gram in trigrams(norm):
+                self._grams[gram].discard((key, norm))
+            self._gram_counts.pop((key, norm), None)
+        self._sorted_dirty = True
+
+    def exact(self, query: str) -> List[Hashable]:
+        return list(self._exact.get(normalize(query), ()))
+
+    def prefix(self, query: str, limit: int = 25) -> List[Hashable]:
+        """
+        Gets keys with a title starting with the query, in alphabetical order
+        """
+        if self._sorted_dirty:
+            self._sorted = sorted((norm, key) for (key, norm) in self._gram_counts)
+            self._sorted_dirty = False
+        query = normalize(query)
+        keys = []
+        start = bisect.bisect_left(self._sorted, (query,))
+        for norm, key in self._sorted[start:]:
+            if not norm.startswith(query) or len(keys) >= limit:
+                break
+            if key not in keys:
+                keys.append(key)
+        return keys
+
+    def search(
+        self, query: str, limit: int = 10, threshold: float = 0.3
+    ) -> List[Tuple[Hashable, float]]:
+        """
+        Finds the titles most similar to the query
+
+        Similarity is the average of the Dice coefficient of the trigram sets
+        and how much of the query is contained in the title, so a short query
+        still matches a long title. Titles starting with the query get a bonus.
+
+        :param query: text to look for
+        :param limit: maximum number of results
+        :param threshold: minimum similarity (0 to 1) for a result
+        :return: list of (key, score), best first, one per key
+        """
+        query = normalize(query)
+        if not query:
+            return []
+        query_grams = trigrams(query)
+        overlap = defaultdict(int)
+        for gram in query_grams:
+            for entry in self._grams.get(gram, ()):
+                overlap[entry] += 1
+
+        best = {}
+        for (key, norm), shared in overlap.items():
+            dice = 2 * shared / (len(query_grams) + self._gram_counts[(key, norm)])
+            score = (dice + shared / len(query_grams)) / 2
+            if norm.startswith(query):
+                score = min(1.0, score + 0.25)
+            if score >= threshold and score > best.get(key, 0):
+                best[key] = score
+        return heapq.nlargest(limit, best.items(), key=lambda item: item[1])
+
+    def update(self, items: Iterable[Tuple[Hashable, Iterable[str]]]):
+        for key, titles in items:
+            self.add(key, *titles)
+
+
+class TitleCatalog:
+    """
+    Catalog of titles persisted to a JSON file, with a TrigramIndex over them
+
+    Entries are dictionaries keyed by an ID. Subclasses pick the titles an
+    entry is indexed under and know how to refresh themselves. Anything
+    else worth keeping between restarts (ie. refresh timestamps) goes in
+    self.state.
+
+    Args:
+        path (str): JSON file the catalog is saved to
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries = {}
+        self.state = {}
+        self.index = TrigramIndex()
+        self.lock = asyncio.Lock()
+        self.load()
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def titles(entry: dict) -> list:
+        return [entry["title"]]
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.state = data.get("state", {})
+        self.replace(data.get("entries", {}))
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"state": self.state, "entries": self.entries}, f)
+        os.replace(temp_path, self.path)
+
+    def set(self, key: str, entry: dict):
+        self.entries[key] = entry
+        self.index.add(key, *[title for title in self.titles(entry) if title])
+
+    def _build_index(self, entries: dict) -> TrigramIndex:
+        index = TrigramIndex()
+        for key, entry in entries.items():
+            index.add(key, *[title for title in self.titles(entry) if title])
+        return index
+
+    def replace(self, entries: dict):
+        self.index = self._build_index(entries)
+        self.entries = entries
+
+    async def rebuild(self, entries: dict):
+        """
+        Replaces every entry, indexing them in a thread so big catalogs don't block the event loop
+
+        Lookups keep using the old entries until the new index is ready.
+        """
+        index = await asyncio.to_thread(self._build_index, entries)
+        self.entries, self.index = entries, index
+
+    def lookup(self, query: str, limit: int = 5, threshold: float = 0.5) -> List[str]:
+        """
+        Finds the entries a user most likely meant
+
+        An exact title match wins outright. Otherwise the closest fuzzy
+        matches are returned, best first.
+
+        :param query: the user's search
+        :param limit: maximum number of keys to return
+        :param threshold: minimum similarity (0 to 1) of a fuzzy match
+        :return: list of entry keys
+        """
+        exact = self.index.exact(query)
+        if exact:
+            return exact[:limit]
+        return [key for key, _ in self.index.search(query, limit=limit, threshold=threshold)]
+
+    def suggest(self, query: str, limit: int = 25) -> List[str]:
+        """
+        Suggests titles for a partially typed query, ie. for autocomplete
+
+        Titles starting with the query come first, and fuzzy matches fill in
+        the rest.
+
+        :param query: what the user has typed so far
+        :param limit: maximum number of titles
+        :return: list of titles
+        """
+        if not normalize(query):
+            return []
+        keys = self.index.prefix(query, limit=limit)
+        if len(keys) < limit:
+            keys += [key for key, _ in self.index.search(query, limit=limit) if key not in keys]
+        titles = [self.titles(self.entries[key])[0] for key in keys]
+        return list(dict.fromkeys(titles))[:limit]
@@ -1,13 +1,18 @@
-import requests
-
 from discord.ext import commands
 
 
 class Googlebot(commands.Cog):
-    def __init__(self, logger, google_api, bot=None):
+    def __init__(self, logger, settings, bot=None, http=None):
         self.bot = bot
+        self.http = http
         self.logger = logger
-        self.google_api = google_api
+        self.google_api = settings.google_api_key
+
+    def apply_settings(self, settings):
+        """
+        Switches to a new Google API key
+        """
+        self.google_api = settings.google_api_key
 
     async def respond(self, ctx, message, view=None):
         if ctx.interaction:
@@ -32,14 +37,17 @@ class Googlebot(commands.Cog):
             if len(query) < 150:
                 # TODO: I guess this is unique to each deployment?
                 cx_id = "009855409252983983547:3xrcodch8sc"
-                url = (
-                    f"https://www.googleapis.com/customsearch/v1?q={search}"
-                    + f"&cx={cx_id}&safe=active&searchType=image"
-                    + f"&key={self.google_api}"
-                )
-                r = requests.get(url)
+                url = "https://www.googleapis.com/customsearch/v1"
+                params = {
+                    "q": search,
+                    "cx": cx_id,
+                    "safe": "active",
+                    "searchType": "image",
+                    "key": self.google_api,
+                }
+                r = await self.http.get_json(url, params=params)
                 try:
-                    response = r.json()["items"][0]["link"]
+                    response = r["items"][0]["link"]
                     await self.respond(ctx, response)
                 except KeyError:
                     await self.respond(ctx, f"No results found for {query} :(")
@@ -64,11 +72,11 @@ class Googlebot(commands.Cog):
         if search:
             query = "".join(search)
             if len(query) < 250:
-                google_url = "https://www.googleapis.com/youtube/v3/search?part=snippet&type=video"
-                search_query = f"&q={query}&key={self.google_api}"
-                r = requests.get(f"{google_url}{search_query}")
+                google_url = "https://www.googleapis.com/youtube/v3/search"
+                params = {"part": "snippet", "type": "video", "q": query, "key": self.google_api}
+                r = await self.http.get_json(google_url, params=params)
                 try:
-                    response = r.json()["items"][0]["id"]["videoId"]
+                    response = r["items"][0]["id"]["videoId"]
                 except IndexError:
                     await self.respond(ctx, f"Could not find any videos with search {query}")
                     return
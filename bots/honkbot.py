@@ -1,16 +1,26 @@
 # Python Standard Library
 import datetime
+import os
 import pytz
 import re
 
-# Third party libraries
-import requests
-
 # Discord
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 from discord.errors import Forbidden
 
+# Honkbot
+from bots.cache import TTLCache
+from bots.outbox import EASTER_EGG, Outbox
+from bots.triggers import TriggerEngine
+from bots.speedrun import (
+    GameIndex,
+    SpeedrunClient,
+    find_category,
+    format_runs,
+    parse_record_query,
+)
+
 CUSTOM_ROLES = {
     "AKR": "Akron",
     "CIN": "Cincinnati",
@@ -84,7 +94,7 @@ class RoleView(discord.ui.View):
 
 
 class Honkbot(commands.Cog):
-    def __init__(self, logger, speedrun_api, bot=None):
+    def __init__(self, logger, settings, bot=None, http=None, outbox=None):
         self.eamuse_maintenance = {
             "daily": (
                 datetime.time(hour=20, tzinfo=pytz.utc),
@@ -107,9 +117,40 @@ class Honkbot(commands.Cog):
 
         self.bot = bot
         self.logger = logger
-        self.speedrun_api = speedrun_api
+        self.speedrun_api = settings.speedrun_api_key
+        self.http = http
+        self.outbox = outbox or Outbox()
+        self.speedrun = SpeedrunClient(http, self.speedrun_api)
+        self.game_index = GameIndex(os.path.join(settings.data_dir, "speedrun_games.json"))
+        self.triggers = TriggerEngine.load(settings.trigger_config_path)
+
+        # Last !record candidates per (channel, user), so a repeat or a "#2"
+        # follow-up doesn't search again
+        self.record_searches = TTLCache(ttl=10 * 60, maxsize=1000)
+
+    async def cog_load(self):
+        if self.speedrun_api:
+            self.refresh_game_index.start()
 
-        self.lastRecordSearch = ""
+    async def cog_unload(self):
+        self.refresh_game_index.cancel()
+
+    def apply_settings(self, settings):
+        """
+        Switches to a new speedrun.com API key and reloads the trigger config
+        """
+        self.triggers = TriggerEngine.load(settings.trigger_config_path)
+        self.speedrun_api = settings.speedrun_api_key
+        self.speedrun.api_key = self.speedrun_api
+        if self.speedrun_api and not self.refresh_game_index.is_running():
+            self.refresh_game_index.start()
+
+    @tasks.loop(hours=6)
+    async def refresh_game_index(self):
+        try:
+            await self.game_index.refresh(self.speedrun)
+        except Exception as e:
+            self.logger.warning(f"Could not refresh the speedrun.com game index: {e!r}")
 
     @commands.Cog.listener()
     async def on_ready(self):
@@ -350,8 +391,8 @@ class Honkbot(commands.Cog):
         if not name:
             await self.respond(ctx, "No one to insult :(")
         else:
-            r = requests.get("https://quandyfactory.com/insult/json")
-            insult = r.json()["insult"]
+            response = await self.http.get_json("https://quandyfactory.com/insult/json")
+            insult = response["insult"]
             await self.respond(ctx, insult.replace("Thou art", f"{name} is"))
 
     @commands.hybrid_command()
@@ -366,8 +407,17 @@ class Honkbot(commands.Cog):
         """
         Accesses speedrun.com to get world record of given game.
 
+        A category and a number of places can follow the game, separated by |
+        When a search has multiple results, #N picks one of them.
+
         User Arguments:
             search: the game to search for
+
+        Examples:
+            !record Super Mario 64
+            !record Super Mario 64 | 16 Star
+            !record Super Mario 64 | 70 Star | top 5
+            !record #2
         """
 
         if not self.speedrun_api:
@@ -375,84 +425,121 @@ class Honkbot(commands.Cog):
             return
 
         if search:
-            auth = {"Authorization": "Token {}".format(self.speedrun_api)}
-            results = []
-            if len(search) < 100:
-                base_url = "https://www.speedrun.com/api/v1/"
-                api_next = "".join([base_url, "games?name={}".format(search)])
-                while api_next:
-                    r = requests.get(api_next, headers=auth)
-                    for game in r.json()["data"]:
-                        results.append(game)
-                    next_page = ""
-                    for page in r.json()["pagination"]["links"]:
-                        if "next" in page["rel"]:
-                            next_page = page["uri"]
-                    api_next = next_page
+            game_search, category_name, top = parse_record_query(search)
+            if game_search and len(game_search) < 100:
+                state_key = (ctx.channel.id, ctx.author.id)
+                last_search = self.record_searches.get(state_key)
+                pick = re.fullmatch(r"#(\d+)", game_search)
+                if pick and not last_search:
+                    await ctx.send("Search for a game first, then pick one of the results")
+                    return
+                if pick:
+                    index = int(pick.group(1)) - 1
+                    if not 0 <= index < len(last_search["results"]):
+                        await ctx.send(f"Pick a number from 1 to {len(last_search['results'])}")
+                        return
+                    results = [last_search["results"][index]]
+                elif last_search and game_search.lower() == last_search["search"]:
+                    results = last_search["results"][:1]
+                else:
+                    results = await self.find_games(game_search)
+                    self.record_searches.set(
+                        state_key, {"search": game_search.lower(), "results": results}
+                    )
                 if results:
-                    if search == self.lastRecordSearch:
-                        results = [results[0]]
                     if len(results) == 1:
-                        game_id = results[0]["id"]
-                        r = requests.get("".join([base_url, "games/", game_id]), headers=auth)
-                        game_name = r.json()["data"]["names"]["international"]
-                        r = requests.get(
-                            "".join([base_url, "games/", game_id, "/categories"]),
-                            headers=auth,
-                        )
-                        game_category = {}
-                        for category in r.json()["data"]:
-                            if category["name"].startswith("Any%"):
-                                game_category = category
-                                break
-                        game_records_url = ""
+                        game = await self.speedrun.get_game(results[0][0])
+                        game_name = game["names"]["international"]
+                        game_category = find_category(game, category_name)
                         if game_category:
-                            for link in game_category["links"]:
-                                if "records" in link["rel"]:
-                                    game_records_url = link["uri"]
-                            r = requests.get(game_records_url, headers=auth)
-                            run = r.json()["data"][0]["runs"][0]["run"]
-                            record = run["times"]["realtime"][2:]
-                            user_id = run["players"][0]["id"]
-                            r = requests.get("".join([base_url, "users/", user_id]), headers=auth)
-                            user_name = r.json()["data"]["names"]["international"]
-
+                            leaderboard = await self.speedrun.get_leaderboard(
+                                game["id"], game_category["id"], top
+                            )
+                            runs = format_runs(leaderboard)
+                            category = game_category["name"]
+                            if not runs:
+                                await ctx.send(f"There are no {category} runs for {game_name}")
+                            elif top == 1:
+                                _, record, user_name = runs[0]
+                                await ctx.send(
+                                    f"The {category} record for {game_name} is "
+                                    + f"{record} by {user_name}"
+                                )
+                            else:
+                                lines = [
+                                    f"{place}. {time} by {players}"
+                                    for place, time, players in runs
+                                ]
+                                await ctx.send(
+                                    f"Top {top} {category} runs for {game_name}:\n"
+                                    + "\n".join(lines)
+                                )
+                        elif category_name:
+                            categories = [
+                                category["name"]
+                                for category in game["categories"]["data"]
+                                if category["type"] == "per-game"
+                            ]
                             await ctx.send(
-                                f"The Any% record for {game_name} is {record} by {user_name}"
+                                f"{game_name} has no {category_name} category. "
+                                + f"Try one of: {', '.join(categories)}"
                             )
-
                         else:
                             await ctx.send("There are no Any% records for {}".format(game_name))
                     elif len(results) < 5:
-                        names = []
-                        for result in results:
-                            names.append(result["names"]["international"])
-                        await ctx.send(
+                        names = [f"#{i}. {name}" for i, (_, name) in enumerate(results, 1)]
+                        # Queued together, so they go out as one message
+                        self.outbox.post(
+                            ctx.channel,
                             "Multiple results. Do a search for the following: {}".format(
                                 ", ".join(names)
-                            )
+                            ),
+                        )
+                        await self.outbox.send(
+                            ctx.channel,
+                            "If you want the first result, redo the search. "
+                            + "Or pick one with `!record #2`",
                         )
-                        await ctx.send("If you want the first result, redo the search")
                     else:
                         await ctx.send("Too many results! Be a little more specific")
                 else:
                     await ctx.send("No games with that name found!")
-            self.lastRecordSearch = search
         else:
             await ctx.send("You gotta give me a game to look for...")
 
+    async def find_games(self, search):
+        """
+        Finds the games a !record search could mean
+
+        Uses the local game index once it has been built, and falls back to
+        the speedrun.com search otherwise.
+
+        :param search: the game the user asked for
+        :return: list of (game ID, game name) tuples, best match first
+        """
+        if len(self.game_index):
+            return [
+                (game_id, self.game_index.name(game_id))
+                for game_id in self.game_index.lookup(search)
+            ]
+        return [
+            (game["id"], game["names"]["international"])
+            for game in await self.speedrun.search_games(search)
+        ]
+
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def recordstats(self, ctx):
+        """
+        Shows how often !record was answered from the speedrun.com cache
+        """
+        lines = [
+            f"{name}: {stats['hits']} hits, {stats['stale_hits']} stale, "
+            + f"{stats['misses']} misses ({stats['hit_rate']:.0%}), {stats['size']} cached"
+            for name, stats in self.speedrun.stats.items()
+        ]
+        await ctx.send("```\n" + "\n".join(lines) + "\n```")
+
     async def eastereggs(self, message):
-        if "honk" in message.content.lower():
-            if "Skeeter" in message.author.display_name:
-                await message.channel.send("beep")
-            else:
-                await message.channel.send("HONK!")
-        if re.search(r"(^|\s)izakaya($|\s.*$)", message.content.lower()):
-            await message.channel.send(
-                "Izakaya, an anime-themed restaurant and bar offering pizza, spirits, Korean corn dogs "
-                + "and Japanese pop culture, located at Fairfield Commons Mall in Beavercreek, Ohio?"
-            )
-        if "dygma" in message.content.lower():
-            await message.channel.send("whats dygma")
-        if re.search(r"(s?he|they)\s.+\son\smy\s.+\still?\si", message.content.lower()):
-            await message.channel.send("# [𝐄𝐗𝐓𝐑𝐄𝐌𝐄𝐋𝐘 𝐋𝐎𝐔𝐃 𝐈𝐍𝐂𝐎𝐑𝐑𝐄𝐂𝐓 𝐁𝐔𝐙𝐙𝐄𝐑]")
+        for response in self.triggers.responses(message):
+            self.outbox.post(message.channel, response, priority=EASTER_EGG)
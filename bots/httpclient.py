@@ -0,0 +1,119 @@
+"""
+Shared HTTP client for every cog.
+
+One aiohttp session is kept for the whole process so that connections are
+pooled and kept alive per host. aiohttp already sends Accept-Encoding and
+transparently decompresses gzip/deflate (and brotli, if installed) bodies.
+On top of the connector's own limits, each host gets its own semaphore so a
+slow site can't eat every connection slot.
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import aiohttp
+
+USER_AGENT = "honkbot (https://github.com/tylernap/honkbot)"
+
+
+class HttpClient:
+    """
+    Process-wide async HTTP client
+
+    Args:
+        limit (int): Total number of simultaneous connections
+        limit_per_host (int): Default number of simultaneous requests to a single host
+        host_limits (dict): Per-host overrides of limit_per_host, ie. {"remywiki.com": 4}
+        timeout (float): Total timeout in seconds for a single request
+    """
+
+    def __init__(
+        self,
+        limit: int = 100,
+        limit_per_host: int = 10,
+        host_limits: Optional[Dict[str, int]] = None,
+        timeout: float = 30,
+    ):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.host_limits = host_limits or {}
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self._session = None
+        self._semaphores = {}
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        # The session has to be created inside the running loop, so wait
+        # until the first request to build it
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.limit, ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=self.timeout,
+                headers={"User-Agent": USER_AGENT},
+                auto_decompress=True,
+            )
+        return self._session
+
+    def _semaphore(self, url: str) -> asyncio.Semaphore:
+        host = urlsplit(url).hostname or ""
+        if host not in self._semaphores:
+            self._semaphores[host] = asyncio.Semaphore(
+                self.host_limits.get(host, self.limit_per_host)
+            )
+        return self._semaphores[host]
+
+    @asynccontextmanager
+    async def request(self, method: str, url: str, **kwargs):
+        """
+        Makes a request while holding the host's concurrency slot
+
+        Usage:
+            async with http.request("GET", url) as response:
+                body = await response.read()
+        """
+        async with self._semaphore(url):
+            async with self.session.request(method, url, **kwargs) as response:
+                yield response
+
+    async def get_json(self, url: str, **kwargs):
+        async with self.request("GET", url, **kwargs) as response:
+            return await response.json(content_type=None)
+
+    async def get_text(self, url: str, **kwargs) -> str:
+        async with self.request("GET", url, **kwargs) as response:
+            return await response.text()
+
+    async def head(self, url: str, **kwargs) -> aiohttp.ClientResponse:
+        async with self.request("HEAD", url, **kwargs) as response:
+            return response
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+
+def parse_host_limits(value: Optional[str]) -> Dict[str, int]:
+    """
+    Parses a host limit setting like "remywiki.com=4,www.speedrun.com=8"
+
+    :param value: comma separated host=limit pairs
+    :return: dictionary of host to limit
+    """
+    limits = {}
+    if not value:
+        return limits
+    for item in value.split(","):
+        host, _, limit = item.strip().partition("=")
+        if host and limit.isdigit():
+            limits[host] = int(limit)
+    return limits
@@ -0,0 +1,295 @@
+"""
+Outbound message scheduler shared by the cogs.
+
+Every plain text reply goes through an Outbox instead of straight to
+channel.send. Each channel gets a token bucket sized below Discord's own
+per-channel limit, so a burst of replies waits here instead of being
+answered with 429s that hold up everything else. While a channel waits
+for a token, the replies queued behind it pile up. When the token comes,
+they are joined into as few messages as fit in Discord's 2000 characters,
+command responses only with command responses and easter eggs only with
+easter eggs. Command responses always go before easter eggs. Easter eggs
+that waited too long are dropped, since a late "HONK!" is worse than
+none. A quiet channel's queue is forgotten once its bucket has filled
+back up.
+
+OutboxBot routes ctx.send through the outbox for every command, so cogs
+don't have to know about it. Replies with a view, embed, file or other
+options, and interaction responses, are sent straight away, as before.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+from discord.ext import commands
+
+logger = logging.getLogger(__name__)
+
+# Priorities, lowest goes first
+COMMAND = 0
+EASTER_EGG = 1
+
+# Longest message Discord accepts
+MAX_LENGTH = 2000
+
+
+class TokenBucket:
+    """
+    Allows rate sends per second on average, and bursts of up to capacity
+
+    Args:
+        rate (float): Tokens added per second
+        capacity (int): Most tokens kept
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self) -> float:
+        """
+        Takes a token if there is one
+
+        :return: 0 if a token was taken, otherwise seconds until there is one
+        """
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def give_back(self):
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+    def until_full(self) -> float:
+        """
+        :return: seconds until the bucket is full again, 0 if it is
+        """
+        self._refill()
+        return (self.capacity - self.tokens) / self.rate
+
+
+class _Reply:
+    __slots__ = ("content", "kwargs", "future", "queued_at")
+
+    def __init__(self, content: str, kwargs: dict, future: asyncio.Future):
+        self.content = content
+        self.kwargs = kwargs
+        self.future = future
+        self.queued_at = time.monotonic()
+
+
+class _ChannelQueue:
+    def __init__(self, channel, bucket: TokenBucket):
+        self.channel = channel
+        self.bucket = bucket
+        self.replies = {COMMAND: deque(), EASTER_EGG: deque()}
+        # Replies taken off the queue whose message is being sent
+        self.sending = []
+        self.worker = None
+
+    def __len__(self):
+        return sum(len(replies) for replies in self.replies.values())
+
+
+class Outbox:
+    """
+    Per-channel send queues with coalescing and rate limits
+
+    Args:
+        rate (float): Messages per second each channel is allowed on average
+        burst (int): Messages a quiet channel can get at once
+        stale_after (float): Seconds an easter egg may wait before it is dropped
+    """
+
+    def __init__(self, rate: float = 1.0, burst: int = 5, stale_after: float = 10):
+        self.rate = rate
+        self.burst = burst
+        self.stale_after = stale_after
+        self._queues: Dict[int, _ChannelQueue] = {}
+
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.throttled = 0
+
+    def post(self, channel, content: str, priority: int = COMMAND, **kwargs) -> asyncio.Future:
+        """
+        Queues a message without waiting for it to be sent
+
+        :param channel: the discord.abc.Messageable to send to
+        :param content: the message
+        :param priority: COMMAND or EASTER_EGG
+        :param kwargs: other channel.send arguments. Messages with any are never joined with others
+        :return: future of the discord.Message the content ended up in, or None if it was dropped
+        """
+        queue = self._queues.get(channel.id)
+        if queue is None:
+            queue = self._queues[channel.id] = _ChannelQueue(channel, TokenBucket(self.rate, self.burst))
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(self._log_failure)
+        queue.replies[priority].append(_Reply(content, kwargs, future))
+        if queue.worker is None or queue.worker.done():
+            queue.worker = asyncio.ensure_future(self._drain(queue))
+        return future
+
+    async def send(self, channel, content: str, priority: int = COMMAND, **kwargs):
+        """
+        Queues a message and waits for it to be sent
+
+        :return: the discord.Message the content ended up in, or None if it was dropped
+        """
+        return await self.post(channel, content, priority, **kwargs)
+
+    @staticmethod
+    def _log_failure(future: asyncio.Future):
+        # Posted messages may never be awaited, so their errors are logged here
+        if not future.cancelled() and future.exception():
+            logger.warning(f"Could not send a message: {future.exception()!r}")
+
+    @staticmethod
+    def _resolve(reply: _Reply, message=None, error: Optional[Exception] = None):
+        # Whoever awaited the reply may have given up on it
+        if reply.future.done():
+            return
+        if error:
+            reply.future.set_exception(error)
+        else:
+            reply.future.set_result(message)
+
+    def _drop_stale(self, queue: _ChannelQueue):
+        now = time.monotonic()
+        eggs = queue.replies[EASTER_EGG]
+        while eggs and now - eggs[0].queued_at > self.stale_after:
+            self.dropped += 1
+            self._resolve(eggs.popleft(), None)
+
+    def _next_batch(self, queue: _ChannelQueue) -> List[_Reply]:
+        # Adjacent plain replies of the highest waiting priority that fit in one message.
+        # Command replies are never joined with easter eggs, since the command gets the message back
+        batch = []
+        length = -1
+        replies = next((queue.replies[priority] for priority in (COMMAND, EASTER_EGG) if queue.replies[priority]), ())
+        while replies:
+            reply = replies[0]
+            if batch and (reply.kwargs or length + 1 + len(reply.content) > MAX_LENGTH):
+                break
+            batch.append(replies.popleft())
+            length += 1 + len(reply.content)
+            if reply.kwargs:
+                break
+        return batch
+
+    async def _drain(self, queue: _ChannelQueue):
+        while True:
+            # Stale eggs are dropped before and after waiting, so they never use up a token
+            self._drop_stale(queue)
+            if not len(queue):
+                break
+            wait = queue.bucket.take()
+            if wait:
+                self.throttled += 1
+            while wait:
+                await asyncio.sleep(wait)
+                wait = queue.bucket.take()
+            self._drop_stale(queue)
+            batch = self._next_batch(queue)
+            if not batch:
+                queue.bucket.give_back()
+                continue
+            queue.sending = batch
+            try:
+                message = await queue.channel.send("\n".join(reply.content for reply in batch), **batch[0].kwargs)
+            except Exception as e:
+                for reply in batch:
+                    self._resolve(reply, error=e)
+                continue
+            finally:
+                queue.sending = []
+            self.sent += 1
+            self.coalesced += len(batch) - 1
+            for reply in batch:
+                self._resolve(reply, message)
+        self._evict(queue)
+
+    def _evict(self, queue: _ChannelQueue):
+        # A quiet channel's queue is kept until its bucket is full again, since a
+        # new queue would start with a full one. Runs as the worker finishes, then
+        # again once the bucket should have refilled
+        if self._queues.get(queue.channel.id) is not queue or len(queue):
+            return
+        if queue.worker is not None and not queue.worker.done() and queue.worker is not asyncio.current_task():
+            return
+        refilled = queue.bucket.until_full()
+        if refilled:
+            asyncio.get_running_loop().call_later(refilled, self._evict, queue)
+        else:
+            del self._queues[queue.channel.id]
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "dropped": self.dropped,
+            "throttled": self.throttled,
+            "queued": sum(len(queue) for queue in self._queues.values()),
+        }
+
+    def close(self):
+        """
+        Stops sending. Replies still waiting are resolved with None, as if they were dropped
+        """
+        for queue in self._queues.values():
+            if queue.worker:
+                queue.worker.cancel()
+            for reply in queue.sending:
+                self._resolve(reply, None)
+            for replies in queue.replies.values():
+                while replies:
+                    self._resolve(replies.popleft(), None)
+        self._queues.clear()
+
+
+class OutboxContext(commands.Context):
+    """
+    Context whose plain text replies go through the bot's Outbox
+    """
+
+    async def send(self, content: Optional[str] = None, **kwargs):
+        outbox = getattr(self.bot, "outbox", None)
+        if outbox is None or content is None or kwargs or self.interaction is not None:
+            return await super().send(content, **kwargs)
+        return await outbox.send(self.channel, str(content))
+
+
+class OutboxBot(commands.Bot):
+    """
+    Bot whose commands reply through an Outbox
+
+    Args:
+        outbox (Outbox): The outbox shared with the cogs
+        *args: commands.Bot arguments
+        **kwargs: commands.Bot keyword arguments
+    """
+
+    def __init__(self, outbox: Outbox, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.outbox = outbox
+
+    async def get_context(self, origin, *, cls=OutboxContext):
+        return await super().get_context(origin, cls=cls)
+
+    async def close(self):
+        self.outbox.close()
+        await super().close()
@@ -0,0 +1,171 @@
+"""
+Persistent cache for downloaded web pages.
+
+Every page is stored on disk next to the ETag and Last-Modified headers it
+came with. A page younger than max_age is served straight from disk. An
+older one is revalidated with a conditional GET, and on a 304 the cached
+body is served again. The cache is bounded by total size and drops the
+least recently used pages first.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+from urllib.parse import urlencode
+
+from bots.httpclient import HttpClient
+
+
+class PageCache:
+    """
+    Size-bounded, on-disk LRU cache of page bodies
+
+    Args:
+        http (HttpClient): The shared HttpClient
+        directory (str): Folder the pages are stored in
+        max_bytes (int): Total size of cached bodies before pages are evicted
+        max_age (float): Seconds a page is served without revalidating it
+    """
+
+    def __init__(
+        self,
+        http: HttpClient,
+        directory: str,
+        max_bytes: int = 200 * 1024 * 1024,
+        max_age: float = 60 * 60,
+    ):
+        self.http = http
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self._sizes = OrderedDict()
+        self._total = 0
+        self._scan()
+
+    def _scan(self):
+        # Rebuild the LRU order from the files' access times
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        for filename in os.listdir(self.directory):
+            if filename.endswith(".body"):
+                stat = os.stat(os.path.join(self.directory, filename))
+                entries.append((stat.st_mtime, filename[: -len(".body")], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._sizes[key] = size
+            self._total += size
+
+    def _path(self, key: str, extension: str) -> str:
+        return os.path.join(self.directory, f"{key}.{extension}")
+
+    @staticmethod
+    def cache_key(url: str, params: Optional[dict] = None) -> str:
+        if params:
+            url = f"{url}?{urlencode(sorted(params.items()))}"
+        return hashlib.sha256(url.encode()).hexdigest()
+
+    def _read(self, key: str):
+        try:
+            with open(self._path(key, "meta")) as f:
+                meta = json.load(f)
+            with open(self._path(key, "body"), encoding="utf-8") as f:
+                body = f.read()
+        except (OSError, ValueError):
+            return None, None
+        # Touch the body so the LRU order survives a restart
+        os.utime(self._path(key, "body"))
+        return meta, body
+
+    def _write(self, key: str, meta: dict, body: str) -> int:
+        for extension, write in (
+            ("body", lambda f: f.write(body)),
+            ("meta", lambda f: json.dump(meta, f)),
+        ):
+            temp_path = f"{self._path(key, extension)}.{threading.get_ident()}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                write(f)
+            os.replace(temp_path, self._path(key, extension))
+        return os.path.getsize(self._path(key, "body"))
+
+    def _remove(self, keys: list):
+        for key in keys:
+            for extension in ("body", "meta"):
+                try:
+                    os.remove(self._path(key, extension))
+                except OSError:
+                    pass
+
+    async def _store(self, key: str, meta: dict, body: str):
+        # Files are written off the loop, the bookkeeping stays on it
+        size = await asyncio.to_thread(self._write, key, meta, body)
+        self._total += size - self._sizes.pop(key, 0)
+        self._sizes[key] = size
+        evicted = []
+        while self._total > self.max_bytes and len(self._sizes) > 1:
+            old_key, old_size = self._sizes.popitem(last=False)
+            self._total -= old_size
+            evicted.append(old_key)
+        if evicted:
+            await asyncio.to_thread(self._remove, evicted)
+
+    async def get_text(self, url: str, params: Optional[dict] = None) -> str:
+        """
+        Gets a page, from the cache when possible
+
+        :param url: page URL
+        :param params: query string parameters
+        :return: the page body
+        """
+        key = self.cache_key(url, params)
+        meta, body = None, None
+        if key in self._sizes:
+            meta, body = await asyncio.to_thread(self._read, key)
+            if meta is None:
+                self._total -= self._sizes.pop(key)
+            else:
+                self._sizes.move_to_end(key)
+                if time.time() - meta["fetched_at"] < self.max_age:
+                    self.hits += 1
+                    return body
+
+        headers = {}
+        if meta:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+        async with self.http.request("GET", url, params=params, headers=headers) as response:
+            if response.status == 304 and body is not None:
+                self.revalidated += 1
+                meta["fetched_at"] = time.time()
+                await self._store(key, meta, body)
+                return body
+            text = await response.text()
+            self.misses += 1
+            if response.status == 200:
+                meta = {
+                    "url": str(response.url),
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                    "fetched_at": time.time(),
+                }
+                await self._store(key, meta, text)
+            return text
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "pages": len(self._sizes),
+            "bytes": self._total,
+            "hits": self.hits,
+            "revalidated": self.revalidated,
+            "misses": self.misses,
+        }
@@ -1,19 +1,208 @@
 from bs4 import BeautifulSoup
-from typing import Optional
-import requests
+from bs4.filter import ElementFilter
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context
+from typing import Dict, Optional
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+import asyncio
+import json
+import logging
+import os
 import re
-from discord.ext import commands
+import time
+from discord import app_commands
+from discord.ext import commands, tasks
 
+from bots.cache import TTLCache
+from bots.fuzzy import TitleCatalog, normalize, similarity
+from bots.httpclient import HttpClient
+from bots.pagecache import PageCache
+
+# Set from the bot's settings by configure. REMY_URL can be pointed
+# elsewhere, ie. at a local stand-in server
 REMY_URL = "https://remywiki.com"
+# "api" uses the MediaWiki api.php endpoints and falls back to scraping,
+# "html" only scrapes the rendered pages
+REMY_RESOLVER = "api"
+
+logger = logging.getLogger(__name__)
+
+# Image types picked out of galleries and captions, in order of preference
+IMAGE_TYPES = ("jacket", "banner", "background", "logo")
+
+# Song lookups by normalized query, so a !banner after a !jacket is free.
+# Queries that found no song are only remembered for a while, in case the
+# song was just added or the wiki was having trouble
+SONG_IMAGES = TTLCache(ttl=24 * 60 * 60, maxsize=2048)
+MISSING_SONGS = TTLCache(ttl=10 * 60, maxsize=4096)
+
+# How often the song catalog is downloaded in full instead of just new songs
+FULL_REFRESH_INTERVAL = 7 * 24 * 60 * 60
+# Similarity above which a catalog title is trusted without searching RemyWiki
+NEAR_EXACT = 0.8
+
+_PARSE_POOL = None
+# ("process" or "thread", workers) of the parse pool
+_PARSE_POOL_CONFIG = ("process", 2)
+
+
+def configure(settings):
+    """
+    Takes up the RemyWiki settings. A parse pool of another kind or size is
+    replaced the next time a page is parsed, and songs looked up on another
+    wiki are forgotten
+
+    :param settings: the bot's settings.Settings
+    """
+    global REMY_URL, REMY_RESOLVER, _PARSE_POOL_CONFIG
+    remy_url = settings.remy_url.rstrip("/")
+    if remy_url != REMY_URL:
+        SONG_IMAGES.clear()
+        MISSING_SONGS.clear()
+    REMY_URL = remy_url
+    REMY_RESOLVER = settings.remy_resolver
+    pool_config = (settings.remy_parse_pool, settings.remy_parse_workers)
+    if pool_config != _PARSE_POOL_CONFIG:
+        _PARSE_POOL_CONFIG = pool_config
+        close_parse_pool()
+
+
+def page_url(title: str) -> str:
+    return f"{REMY_URL}/{quote(title.replace(' ', '_'))}"
+
+
+def href_title(href: str) -> str:
+    # Inverse of page_url for the relative links on a page, ie. "/MAX_300_Gallery"
+    url = urlsplit(href)
+    title = parse_qs(url.query).get("title", [None])[0] or unquote(url.path.rsplit("/", 1)[-1])
+    return title.replace("_", " ")
+
 
+class RemyStrainer(ElementFilter):
+    """
+    Only builds the parts of a RemyWiki page the scraper reads
+
+    Tags outside of these (and their contents) are skipped while parsing,
+    which is most of every page.
+    """
+
+    KEPT_CLASSES = {"thumbinner", "gallerybox", "mw-search-exists", "mw-search-results"}
+
+    def allow_tag_creation(self, nsprefix, name, attrs):
+        attrs = attrs or {}
+        classes = attrs.get("class") or ""
+        if isinstance(classes, str):
+            classes = classes.split()
+        if self.KEPT_CLASSES.intersection(classes):
+            return True
+        if name == "h1":
+            return attrs.get("id") == "firstHeading"
+        if name == "a":
+            return attrs.get("title") == "Category:Songs" or "Gallery" in (attrs.get("href") or "")
+        return False
+
+    def allow_string_creation(self, string):
+        return False
+
+
+def classify_image(description: str) -> Optional[str]:
+    for image_type in IMAGE_TYPES:
+        if image_type in description:
+            return image_type
+    return None
 
-def page_is_song(page: BeautifulSoup):
-    if page.find("a", {"title": "Category:Songs"}):
-        return True
-    return False
 
+def extract_page(html: str, partial: bool = True, base_url: Optional[str] = None) -> dict:
+    """
+    Pulls everything the scraper needs out of a RemyWiki page
+
+    This is CPU heavy, so it runs in the parse pool and only returns plain
+    data.
 
-def search_song(query: str) -> Optional[BeautifulSoup]:
+    :param html: the page
+    :param partial: only parse the parts of the page that are used
+    :param base_url: the wiki image URLs are relative to, REMY_URL by default
+    :return: a dictionary with the page "title", whether it "is_song", the
+        "gallery" link, the "search_exists" and "first_result" links of a
+        search page, and the "images" and "gallery_images" found (image
+        type to absolute URL)
+    """
+    base_url = base_url or REMY_URL
+    page = BeautifulSoup(html, "html.parser", parse_only=RemyStrainer() if partial else None)
+
+    heading = page.find("h1", {"id": "firstHeading"})
+    gallery = page.find("a", href=re.compile(r"Gallery"))
+    search_exists = page.find("p", {"class": "mw-search-exists"})
+    search_results = page.find("ul", {"class": "mw-search-results"})
+    first_result = search_results.find("a") if search_results else None
+    if search_exists:
+        search_exists = search_exists.find("a")
+
+    images = {}
+    for image in page.find_all("div", {"class": "thumbinner"}):
+        caption = image.find("div", {"class": "thumbcaption"})
+        image_type = classify_image(caption.text) if caption else None
+        if image_type and image_type not in images:
+            images[image_type] = f"{base_url}{image.find('img')['src']}"
+
+    gallery_images = {}
+    for section in page.find_all("li", {"class": "gallerybox"}):
+        image_type = classify_image(section.find("p").text)
+        if image_type and image_type not in gallery_images:
+            img_urls = section.find("img")["srcset"].split(",")
+            largest_image = img_urls[-1].split(" ")[1]  # space,url,size
+            gallery_images[image_type] = f"{base_url}{largest_image}"
+
+    return {
+        "title": heading.text if heading else None,
+        "is_song": bool(page.find("a", {"title": "Category:Songs"})),
+        "gallery": gallery["href"] if gallery else None,
+        "search_exists": search_exists["href"] if search_exists else None,
+        "first_result": first_result["href"] if first_result else None,
+        "images": images,
+        "gallery_images": gallery_images,
+    }
+
+
+def parse_pool() -> Executor:
+    """
+    Gets the pool pages are parsed in, creating it on first use
+
+    The remy_parse_pool setting picks a "process" (default) or "thread"
+    pool, and remy_parse_workers its size.
+    """
+    global _PARSE_POOL
+    if _PARSE_POOL is None:
+        kind, workers = _PARSE_POOL_CONFIG
+        if kind == "process":
+            _PARSE_POOL = ProcessPoolExecutor(workers, mp_context=get_context("spawn"))
+        else:
+            _PARSE_POOL = ThreadPoolExecutor(workers)
+    return _PARSE_POOL
+
+
+def close_parse_pool():
+    global _PARSE_POOL
+    if _PARSE_POOL is not None:
+        _PARSE_POOL.shutdown(wait=False, cancel_futures=True)
+        _PARSE_POOL = None
+
+
+async def fetch_page(pages: PageCache, url: str, params: Optional[dict] = None) -> dict:
+    """
+    Downloads a RemyWiki page and extracts it off the event loop
+
+    :param pages: the RemyWiki PageCache
+    :param url: page URL
+    :param params: query string parameters
+    :return: the extracted page, see extract_page
+    """
+    html = await pages.get_text(url, params=params)
+    # Worker processes don't share this module's settings, so the URL is passed along
+    return await asyncio.get_running_loop().run_in_executor(parse_pool(), extract_page, html, True, REMY_URL)
+
+
+async def search_song(pages: PageCache, query: str) -> Optional[dict]:
     """
     Tries to find a certain song on RemyWiki
 
@@ -24,59 +213,245 @@ def search_song(query: str) -> Optional[BeautifulSoup]:
         search in songs only if we haven't. So exact titles should always match,
         and close ones should usually match.
 
+    :param pages: the RemyWiki PageCache
     :param query: a string representing something that's supposed to be a
         song name to find
-    :return: a BeautifulSoup object representing a RemyWiki page for a song,
+    :return: the extracted RemyWiki page for a song (see extract_page),
         or None, representing a lack of results
     """
     search_data = {"search": query}
-    remy_search = requests.get(f"{REMY_URL}/index.php", params=search_data)
-    remy_data = BeautifulSoup(remy_search.text, "html.parser")
+    remy_data = await fetch_page(pages, f"{REMY_URL}/index.php", params=search_data)
 
     # If we were redirected to a Page and it's a Song, just return it
-    if page_is_song(remy_data):
+    if remy_data["is_song"]:
         return remy_data
 
     # If we're not on a Page, check to see if the Search found an exact match
-    already_found = remy_data.find("p", {"class": "mw-search-exists"})
-    if already_found:
-        song_result = requests.get(f"{REMY_URL}{already_found.strong.a['href']}")
-        possible_song = BeautifulSoup(song_result.text, "html.parser")
-        if page_is_song(possible_song):
+    if remy_data["search_exists"]:
+        possible_song = await fetch_page(pages, f"{REMY_URL}{remy_data['search_exists']}")
+        if possible_song["is_song"]:
             return possible_song
 
     # Otherwise, just take the first search result when searching in category
     search_data = {"search": f'{query} incategory:"Songs"'}
-    remy_search = requests.get(f"{REMY_URL}/index.php", params=search_data)
-    remy_data = BeautifulSoup(remy_search.text, "html.parser")
-    first_result = remy_data.find("ul", {"class": "mw-search-results"})
-    if first_result:
-        song_result = requests.get(f"{REMY_URL}{first_result.li.div.a['href']}")
-        return BeautifulSoup(song_result.text, "html.parser")
+    remy_data = await fetch_page(pages, f"{REMY_URL}/index.php", params=search_data)
+    if remy_data["first_result"]:
+        return await fetch_page(pages, f"{REMY_URL}{remy_data['first_result']}")
 
 
-def get_image_from_gallery(href: str, image_type: str) -> Optional[str]:
+async def get_images_from_gallery(pages: PageCache, href: str) -> Dict[str, str]:
     """
-    Gets an image from the Gallery page template on RemyWiki
+    Gets every image from the Gallery page template on RemyWiki
+
+    The page is fetched and parsed once, and the first image of each type
+    is kept.
 
+    :param pages: the RemyWiki PageCache
     :param href: The relative url (including the slash) of a gallery page
-    :param image_type: Either "banner" or "jacket"
 
-    :return: A relative URL pointing to an image OR None
+    :return: A dictionary of image type to absolute image URL
     """
-    gallery_page = requests.get(f"{REMY_URL}{href}")
-    gallery_data = BeautifulSoup(gallery_page.text, "html.parser")
-    image_sections = gallery_data.find_all("li", {"class": "gallerybox"})
-    for section in image_sections:
-        description = section.find("p").text
-        if image_type in description:
-            img_urls = section.find("img")["srcset"].split(",")
-            largest_image = img_urls[-1]
-            return largest_image.split(" ")[1]  # space,url,size
-    return None
+    gallery_page = await fetch_page(pages, f"{REMY_URL}{href}")
+    return gallery_page["gallery_images"]
 
 
-def get_image(query: str, image_type: str = "jacket") -> str:
+async def scrape_song_images(
+    pages: PageCache, query: str, title: Optional[str] = None
+) -> Optional[dict]:
+    """
+    Finds a song and all of its images by scraping the rendered RemyWiki pages
+
+    :param pages: the RemyWiki PageCache
+    :param query: a string representing something that's supposed to be a
+        song name to find
+    :param title: the song's page title, if the catalog already knows it
+    :return: a dictionary with the song "title" and its "images" (image type
+        to URL), or None if no song was found
+    """
+    song_page = None
+    if title:
+        song_page = await fetch_page(pages, page_url(title))
+        if not song_page["is_song"]:
+            song_page = None
+    if not song_page:
+        song_page = await search_song(pages, query)
+    if not song_page:
+        return None
+    images = {}
+    # Images from the Gallery win over the ones on the song page
+    if song_page["gallery"]:
+        images = await get_images_from_gallery(pages, song_page["gallery"])
+    for image_type, url in song_page["images"].items():
+        images.setdefault(image_type, url)
+    return {"title": song_page["title"], "images": images}
+
+
+async def api_query(pages: PageCache, **params) -> dict:
+    """
+    Runs an action=query request against the MediaWiki API
+
+    :param pages: the RemyWiki PageCache
+    :param params: query parameters, ie. titles="Song", prop="links"
+    :return: the "query" part of the response
+    """
+    params.update({"action": "query", "format": "json", "formatversion": "2"})
+    response = await pages.get_text(f"{REMY_URL}/api.php", params=params)
+    return json.loads(response).get("query", {})
+
+
+async def api_gallery(pages: PageCache, song_title: str, link_titles: list) -> Optional[str]:
+    """
+    Finds the Gallery page of a song
+
+    The API lists a page's links by title, not in the order they appear, so
+    a song linking to another song's Gallery can't be told apart by
+    position. A Gallery named after the song is taken. Otherwise the song's
+    rendered text is asked for, and the first Gallery link in it is the
+    song's own, the same one the scraper would follow.
+
+    :param pages: the RemyWiki PageCache
+    :param song_title: the song's page title
+    :param link_titles: titles of every page the song links to
+    :return: the title of the Gallery page, or None if the song has none
+    """
+    galleries = [title for title in link_titles if "Gallery" in title]
+    if not galleries:
+        return None
+    song_key = normalize(song_title)
+    named = [title for title in galleries if song_key and song_key in normalize(title)]
+    if named:
+        # The shortest one is the closest to just the song's name
+        return min(named, key=len)
+
+    params = {"action": "parse", "page": song_title, "prop": "text", "format": "json", "formatversion": "2"}
+    response = await pages.get_text(f"{REMY_URL}/api.php", params=params)
+    html = json.loads(response).get("parse", {}).get("text", "")
+    song_page = await asyncio.get_running_loop().run_in_executor(
+        parse_pool(), extract_page, html, True, REMY_URL
+    )
+    return href_title(song_page["gallery"]) if song_page["gallery"] else None
+
+
+async def api_page_images(pages: PageCache, title: str) -> Dict[str, str]:
+    """
+    Gets every image used on a page, classified by its file name
+
+    :param pages: the RemyWiki PageCache
+    :param title: page title
+    :return: A dictionary of image type to absolute image URL
+    """
+    result = await api_query(
+        pages, titles=title, generator="images", gimlimit="max", prop="imageinfo", iiprop="url"
+    )
+    images = {}
+    for file_page in sorted(result.get("pages", []), key=lambda page: page["title"]):
+        image_type = classify_image(file_page["title"].lower())
+        if image_type and image_type not in images and file_page.get("imageinfo"):
+            images[image_type] = file_page["imageinfo"][0]["url"]
+    return images
+
+
+async def query_song_images(
+    pages: PageCache, query: str, title: Optional[str] = None
+) -> Optional[dict]:
+    """
+    Finds a song and all of its images through the MediaWiki API
+
+    Unless the catalog already knows the title, the first request checks the
+    query as an exact title and runs the category search at the same time.
+    The next gets the song's links to find its Gallery, and the images of
+    the song and Gallery pages are then fetched side by side (see api_gallery
+    for how the Gallery is picked).
+
+    :param pages: the RemyWiki PageCache
+    :param query: a string representing something that's supposed to be a
+        song name to find
+    :param title: the song's page title, if the catalog already knows it
+    :return: a dictionary with the song "title" and its "images" (image type
+        to URL), or None if no song was found
+    """
+    song_title = title
+    if not song_title:
+        result = await api_query(
+            pages,
+            titles=query,
+            redirects="1",
+            prop="categories",
+            clcategories="Category:Songs",
+            list="search",
+            srsearch=f'{query} incategory:"Songs"',
+            srlimit="1",
+        )
+        exact = [page for page in result.get("pages", []) if page.get("categories")]
+        if exact:
+            song_title = exact[0]["title"]
+        elif result.get("search"):
+            song_title = result["search"][0]["title"]
+        else:
+            return None
+
+    links = await api_query(pages, titles=song_title, prop="links", pllimit="max")
+    link_titles = [link["title"] for page in links.get("pages", []) for link in page.get("links", [])]
+    gallery = await api_gallery(pages, song_title, link_titles)
+    page_titles = [gallery, song_title] if gallery else [song_title]
+    page_images = await asyncio.gather(*[api_page_images(pages, title) for title in page_titles])
+    images = {}
+    # Images from the Gallery win over the ones on the song page
+    for found in page_images:
+        for image_type, url in found.items():
+            images.setdefault(image_type, url)
+    return {"title": song_title, "images": images}
+
+
+async def get_song_images(
+    pages: PageCache, query: str, catalog: Optional["SongCatalog"] = None
+) -> Optional[dict]:
+    """
+    Finds a song and all of its images
+
+    If the song catalog has a (near) exact match for the query, its page is
+    used without searching. Otherwise the resolver picked by the
+    remy_resolver setting searches for it. If the API can't find the song or
+    any of its images, the rendered pages are scraped instead. Results are
+    memoized per query, so asking for a banner after a jacket of the same
+    song doesn't make any requests. Queries that found nothing are only
+    remembered for minutes.
+
+    :param pages: the RemyWiki PageCache
+    :param query: a string representing something that's supposed to be a
+        song name to find
+    :param catalog: the SongCatalog, if there is one
+    :return: a dictionary with the song "title" and its "images" (image type
+        to URL), or None if no song was found
+    """
+
+    async def fetch():
+        title = catalog.resolve(query) if catalog else None
+        if REMY_RESOLVER == "api":
+            try:
+                song = await query_song_images(pages, query, title)
+                if song and song["images"]:
+                    return song
+            except Exception as e:
+                logger.warning(f"RemyWiki API lookup failed for {query}: {e!r}")
+        return await scrape_song_images(pages, query, title)
+
+    key = normalize(query)
+    if key in MISSING_SONGS:
+        return None
+    song = await SONG_IMAGES.get_or_fetch(key, fetch)
+    if song is None:
+        SONG_IMAGES.invalidate(key)
+        MISSING_SONGS.set(key, True)
+    return song
+
+
+async def get_image(
+    pages: PageCache,
+    query: str,
+    image_type: str = "jacket",
+    catalog: Optional["SongCatalog"] = None,
+) -> str:
     """
     Gets an image (or a message about no image) from a RemyWiki song page.
 
@@ -84,52 +459,139 @@ def get_image(query: str, image_type: str = "jacket") -> str:
     song page for "song name's jacket" or "song name's banner" and returns
     the image connected to that.
 
+    :param pages: the RemyWiki PageCache
     :param query: a string representing something that's supposed to be a
         song name to find
     :param image_type: Either "jacket" or "banner", default "jacket"
+    :param catalog: the SongCatalog, if there is one
     :return: a response fitting for the bot to return, either the requested
         image or a message describing what it found instead
     """
-    song_page = search_song(query)
-    found_images = {}
-    if song_page:
-        # First try to get the image from the Gallery
-        gallery = song_page.find("a", href=re.compile(r"Gallery"))
-        if gallery:
-            first_gallery_banner = get_image_from_gallery(gallery["href"], "banner")
-            first_gallery_jacket = get_image_from_gallery(gallery["href"], "jacket")
-            if first_gallery_banner:
-                found_images["banner"] = first_gallery_banner
-            if first_gallery_jacket:
-                found_images["jacket"] = first_gallery_jacket
-            if image_type in found_images:
-                return f"{REMY_URL}{found_images[image_type]}"
-        # If there is no Gallery, try to find it on the page
-        images = song_page.find_all("div", {"class": "thumbinner"})
-        for image in images:
-            if "banner" in image.find("div", {"class": "thumbcaption"}).text:
-                found_images["banner"] = f"{REMY_URL}{image.find('img')['src']}"
-            elif "jacket" in image.find("div", {"class": "thumbcaption"}).text:
-                found_images["jacket"] = f"{REMY_URL}{image.find('img')['src']}"
-            if image_type in found_images:
-                return f"{found_images[image_type]}"
-        # If we haven't found the right image in either place
-        song_title = song_page.find("h1", {"id": "firstHeading"}).text
-        # Return any other images we found
-        if any(found_images):
-            image_url = next(img for img in found_images.values() if img)
-            return f"{song_title} does not have a {image_type}, but it does have this:\n{image_url}"
-        # Or give a message that there are no related images
-        else:
-            if song_title.lower() == query.lower():
-                return f"{song_title} does not have any images"
-            else:
-                return f"{query} seems to be the song {song_title} but it does not have any images"
-    else:  # No song page
+    song = await get_song_images(pages, query, catalog)
+    if not song:
         return f"Could not find a song that looks like: {query}"
 
+    song_title = song["title"]
+    found_images = song["images"]
+    if image_type in found_images:
+        return found_images[image_type]
+    # Return any other images we found
+    if found_images:
+        image_url = next(found_images[t] for t in IMAGE_TYPES if t in found_images)
+        return f"{song_title} does not have a {image_type}, but it does have this:\n{image_url}"
+    # Or give a message that there are no related images
+    if song_title.lower() == query.lower():
+        return f"{song_title} does not have any images"
+    return f"{query} seems to be the song {song_title} but it does not have any images"
+
+
+class SongCatalog(TitleCatalog):
+    """
+    Locally stored catalog of RemyWiki song titles, built from Category:Songs
+
+    Titles are also indexed without spaces, so "max300" finds "MAX 300".
+
+    Args:
+        path (str): JSON file the catalog is saved to
+    """
+
+    @staticmethod
+    def titles(entry: dict) -> list:
+        return [entry["title"], entry["title"].replace(" ", "")]
+
+    async def refresh(self, http: HttpClient):
+        """
+        Brings the catalog up to date
+
+        Category members are listed by the time they were added, so an
+        incremental refresh only asks for songs added since the newest one
+        we have. Once a week the whole category is downloaded again to drop
+        deleted and renamed pages.
+
+        :param http: the shared HttpClient
+        """
+        async with self.lock:
+            full = time.time() - self.state.get("full_refreshed_at", 0) > FULL_REFRESH_INTERVAL
+            params = {
+                "action": "query",
+                "format": "json",
+                "formatversion": "2",
+                "list": "categorymembers",
+                "cmtitle": "Category:Songs",
+                "cmnamespace": "0",
+                "cmprop": "ids|title|timestamp",
+                "cmsort": "timestamp",
+                "cmdir": "newer",
+                "cmlimit": "max",
+            }
+            newest = self.state.get("newest")
+            if newest and not full:
+                params["cmstart"] = newest
+            entries = {}
+            while True:
+                r = await http.get_json(f"{REMY_URL}/api.php", params=params)
+                for member in r["query"]["categorymembers"]:
+                    entries[str(member["pageid"])] = {"title": member["title"]}
+                    newest = max(newest or member["timestamp"], member["timestamp"])
+                if "continue" not in r:
+                    break
+                params.update(r["continue"])
+
+            if full:
+                await self.rebuild(entries)
+                self.state["full_refreshed_at"] = time.time()
+            else:
+                for key, entry in entries.items():
+                    self.set(key, entry)
+            self.state["newest"] = newest
+            await asyncio.to_thread(self.save)
+            logger.info(f"RemyWiki song catalog refreshed, {len(self.entries)} songs")
+
+    def resolve(self, query: str) -> Optional[str]:
+        """
+        Maps a query straight to a song title, if the catalog is sure about it
+
+        :param query: a string representing something that's supposed to be a
+            song name to find
+        :return: the song's page title, or None if a search is needed
+        """
+        keys = self.lookup(query, limit=1)
+        if not keys:
+            return None
+        title = self.entries[keys[0]]["title"]
+        if normalize(title) == normalize(query) or self.index.exact(query):
+            return title
+        if similarity(query, title) >= NEAR_EXACT:
+            return title
+        return None
+
 
 class Remybot(commands.Cog):
+    def __init__(self, http: HttpClient, settings):
+        self.http = http
+        self.pages = PageCache(http, os.path.join(settings.data_dir, "remywiki"))
+        self.catalog = SongCatalog(os.path.join(settings.data_dir, "remywiki_songs.json"))
+        configure(settings)
+
+    def apply_settings(self, settings):
+        """
+        Switches RemyWiki URL, resolver and parse pool
+        """
+        configure(settings)
+
+    async def cog_load(self):
+        self.refresh_catalog.start()
+
+    async def cog_unload(self):
+        self.refresh_catalog.cancel()
+        close_parse_pool()
+
+    @tasks.loop(hours=12)
+    async def refresh_catalog(self):
+        try:
+            await self.catalog.refresh(self.http)
+        except Exception as e:
+            logger.warning(f"Could not refresh the RemyWiki song catalog: {e!r}")
 
     async def respond(self, ctx, message, view=None):
         if ctx.interaction:
@@ -144,7 +606,7 @@ class Remybot(commands.Cog):
         User Arguments:
             title: the name of a song to search for
         """
-        response = get_image(title, "jacket")
+        response = await get_image(self.pages, title, "jacket", self.catalog)
         await self.respond(ctx, response)
 
     @commands.hybrid_command()
@@ -155,5 +617,15 @@ class Remybot(commands.Cog):
         User Arguments:
             title: the name of a song to search for
         """
-        response = get_image(title, "banner")
+        response = await get_image(self.pages, title, "banner", self.catalog)
         await self.respond(ctx, response)
+
+    @jacket.autocomplete("title")
+    @banner.autocomplete("title")
+    async def title_autocomplete(self, interaction, current: str):
+        # Discord caps choices at 100 characters, and a cut off title would miss its song
+        return [
+            app_commands.Choice(name=title, value=title)
+            for title in self.catalog.suggest(current)
+            if len(title) <= 100
+        ]
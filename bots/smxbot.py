@@ -1,19 +1,53 @@
-import requests
-import json
+import aiohttp
+import asyncio
+import os
 import re
+from typing import Optional
 from discord.ext import commands
 
+from bots.cache import TTLCache
+from bots.fuzzy import TitleCatalog, normalize
+from bots.httpclient import HttpClient
+
 """
 Tries to find a certain song jacket via SMX's API.
 
 StepManiaX has an API, however it is intentionally publicly undocumented.
 This script uses the format used by StatManiaX to attempt to pull a song
 jacket from the requested song.
+
+Every cover the API confirms is kept in a local SmxCatalog, so a jacket
+asked for the same way before is answered without asking the API again.
+Otherwise a handful of likely slugs are checked at once with HEAD requests.
 """
 
+# Set from the bot's settings by configure
+SMX_URL = "https://data.stepmaniax.com"
+
+# Covers found and not found by probing, by normalized query
+FOUND_COVERS = TTLCache(ttl=24 * 60 * 60, maxsize=1024)
+MISSING_COVERS = TTLCache(ttl=60 * 60, maxsize=4096)
+
+
+def configure(settings):
+    """
+    Takes up the StepManiaX settings. Covers looked up on another server are forgotten
+
+    :param settings: the bot's settings.Settings
+    """
+    global SMX_URL
+    smx_url = settings.smx_url.rstrip("/")
+    if smx_url != SMX_URL:
+        FOUND_COVERS.clear()
+        MISSING_COVERS.clear()
+    SMX_URL = smx_url
 
-def get_image(query: str) -> str:
-    # Todo: compare to a DB of songs, instead of taking the input at face value
+
+def cover_url(slug: str) -> str:
+    return f"{SMX_URL}/uploads/songs/{slug}/cover.png"
+
+
+def guess_slug(query: str) -> str:
     # First, modify the query string to match the SMX API format.
     titled = "".join(word.capitalize() for word in query.split())
     # Remove & symbol because it breaks the URL.
@@ -21,30 +55,168 @@ def get_image(query: str) -> str:
     # If the song is Stop! & Go, capitalize the whole thing, because it's a jerk
     if titled == "Stop!Go":
         titled = titled.upper()
-    url = "https://data.stepmaniax.com/uploads/songs/" + titled + "/cover.png"
-
-    response = requests.request("GET", url)
-    # if API returns an image, return the URL
-    if response.headers.get("content-type") == "image/png":
-        return url
-    # If the API fails to return a song, say so.
-    elif response.headers.get("content-type") == "application/json":
-        responseDump = json.loads(response.text)
-        if responseDump["success"] != "false":
+    return titled
+
+
+def slug_variants(query: str) -> list:
+    """
+    Lists the slugs a song's cover could be under, most likely first
+
+    The API's slugs are mostly the capitalized words of the title run
+    together, but some songs are all caps, keep their own casing, or drop
+    their punctuation.
+    """
+    words = query.replace("&", " ").split()
+    stripped = [re.sub(r"[^\w]", "", word) for word in words]
+    variants = [
+        guess_slug(query),
+        "".join(words),
+        "".join(words).upper(),
+        "".join(word.capitalize() for word in stripped),
+        "".join(stripped),
+        "".join(stripped).upper(),
+        "".join(word.capitalize() for word in query.replace("&", "And").split()),
+    ]
+    return list(dict.fromkeys(variant for variant in variants if variant))
+
+
+class SmxCatalog(TitleCatalog):
+    """
+    Locally cached cover slugs of StepManiaX songs, by the query that found them
+
+    There is no song list to fill the catalog from, so it only holds covers
+    the API has confirmed by being probed. Queries are user-typed, so only
+    the exact (normalized) query is trusted, never a similar one.
+
+    Args:
+        path (str): JSON file the catalog is saved to
+    """
+
+    @staticmethod
+    def titles(entry: dict) -> list:
+        # Nothing is searched for fuzzily, so nothing is indexed
+        return []
+
+    def use_server(self, url: str):
+        """
+        Forgets the covers found on another SMX server
+        """
+        if self.state.get("smx_url", url) != url:
+            self.replace({})
+        self.state["smx_url"] = url
+
+    def resolve(self, query: str) -> Optional[str]:
+        """
+        Maps a query to a cover slug, if it has found one before
+
+        :param query: a string representing something that's supposed to be a
+            song name to find
+        :return: the song's slug, or None if it isn't in the catalog
+        """
+        entry = self.entries.get(normalize(query))
+        return entry["slug"] if entry else None
+
+    async def learn(self, query: str, slug: str):
+        key = normalize(query)
+        if key and self.entries.get(key, {}).get("slug") != slug:
+            self.set(key, {"slug": slug})
+            await asyncio.to_thread(self.save)
+
+
+async def probe_cover(http: HttpClient, slug: str) -> Optional[str]:
+    """
+    Checks if a cover exists with a HEAD request, without downloading it
+
+    :return: the slug if there is a cover under it, otherwise None
+    """
+    async with http.request("HEAD", cover_url(slug)) as response:
+        if response.status == 200 and response.content_type == "image/png":
+            return slug
+    return None
+
+
+async def find_cover(http: HttpClient, query: str) -> Optional[str]:
+    """
+    Probes every slug variant of a query at once and takes the most likely hit
+
+    The probes run together, but the answer is the first slug in
+    slug_variants order that has a cover, not whichever answered first.
+
+    :param http: the shared HttpClient
+    :param query: a string representing something that's supposed to be a
+        song name to find
+    :return: the slug of the cover, or None if no variant has one
+    :raises aiohttp.ClientError: or asyncio.TimeoutError if none of the probes got an answer
+    """
+    slugs = slug_variants(query)
+    results = await asyncio.gather(*(probe_cover(http, slug) for slug in slugs), return_exceptions=True)
+    errors = []
+    for result in results:
+        if isinstance(result, (aiohttp.ClientError, asyncio.TimeoutError)):
+            errors.append(result)
+        elif isinstance(result, BaseException):
+            raise result
+        elif result:
+            return result
+    if len(errors) == len(slugs):
+        raise errors[0]
+    return None
+
+
+async def get_image(http: HttpClient, query: str, catalog: Optional[SmxCatalog] = None) -> str:
+    """
+    Gets the cover of a StepManiaX song
+
+    Queries that didn't match any cover are remembered for a while, so
+    asking again doesn't reach the SMX server.
+
+    :param http: the shared HttpClient
+    :param query: a string representing something that's supposed to be a
+        song name to find
+    :param catalog: the SmxCatalog, if there is one
+    :return: the cover URL, or a message saying why there isn't one
+    """
+    slug = catalog.resolve(query) if catalog is not None else None
+    if slug:
+        return cover_url(slug)
+
+    key = normalize(query)
+    slug = FOUND_COVERS.get(key)
+    if not slug:
+        if key in MISSING_COVERS:
+            return "StepManiaX API failed to return a song."
+        try:
+            slug = await find_cover(http, query)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return "StepManiaX API could not be reached."
+        if not slug:
+            MISSING_COVERS.set(key, True)
             return "StepManiaX API failed to return a song."
-    # Anything else returned
-    else:
-        return "StepManiaX API could not be reached."
+        FOUND_COVERS.set(key, slug)
+        if catalog is not None:
+            await catalog.learn(query, slug)
+    return cover_url(slug)
 
 
 class Smxbot(commands.Cog):
+    def __init__(self, http: HttpClient, settings):
+        self.http = http
+        self.catalog = SmxCatalog(os.path.join(settings.data_dir, "smx_covers.json"))
+        self.apply_settings(settings)
+
+    def apply_settings(self, settings):
+        """
+        Switches to another StepManiaX API URL
+        """
+        configure(settings)
+        self.catalog.use_server(SMX_URL)
 
     async def respond(self, ctx, message, view=None):
         if ctx.interaction:
             return await ctx.interaction.response.send_message(message, view=view)
         return await ctx.send(message)
 
-    @commands.command()
+    @commands.hybrid_command()
     async def smxjacket(self, ctx, *, title: str):
         """
         Returns a jacket for a stepmaniax song from the StepManiaX API.
@@ -52,5 +224,5 @@ class Smxbot(commands.Cog):
         User Arguments:
             title: the name of a song to search for
         """
-        response = get_image(title)
+        response = await get_image(self.http, title, self.catalog)
         await self.respond(ctx, response)
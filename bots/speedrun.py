@@ -0,0 +1,287 @@
+"""
+Speedrun.com API access for the !record command.
+
+World records don't change very often, so every lookup goes through a
+TTLCache. Popular games are answered straight from the cache while a stale
+entry gets refreshed in the background.
+
+The API can embed related resources in a response, so a game search brings
+its categories along, and a leaderboard brings its players. A !record
+lookup is then one search plus one leaderboard request.
+
+Game names are also kept in a local GameIndex, refreshed in the background,
+so picking a game out of a search happens in-process and only the
+leaderboard itself needs the API.
+"""
+
+import asyncio
+import logging
+import re
+import time
+from typing import Optional, Tuple
+
+from bots.cache import TTLCache
+from bots.fuzzy import TitleCatalog
+from bots.httpclient import HttpClient
+
+logger = logging.getLogger(__name__)
+
+SPEEDRUN_URL = "https://www.speedrun.com/api/v1"
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+
+# Largest page size the API allows
+PAGE_SIZE = 200
+# Number of extra pages requested at once when a search overflows a page
+PAGE_FANOUT = 4
+MAX_TOP = 10
+# Page size the API allows for bulk game listings
+BULK_PAGE_SIZE = 1000
+# How often the game index walks the whole game list instead of just new games
+FULL_REFRESH_INTERVAL = 7 * DAY
+
+
+class SpeedrunClient:
+    """
+    Cached client for the speedrun.com REST API
+
+    Args:
+        http (HttpClient): The shared HttpClient
+        api_key (str): speedrun.com API key
+    """
+
+    def __init__(self, http: HttpClient, api_key: str):
+        self.http = http
+        self.api_key = api_key
+        self.caches = {
+            "games": TTLCache(ttl=DAY, stale_ttl=7 * DAY, maxsize=2048),
+            "leaderboards": TTLCache(ttl=15 * 60, stale_ttl=DAY, maxsize=1024),
+        }
+
+    async def _get(self, path: str, **params) -> dict:
+        return await self.http.get_json(
+            f"{SPEEDRUN_URL}/{path}",
+            params=params,
+            headers={"Authorization": f"Token {self.api_key}"},
+        )
+
+    async def _search_page(self, name: str, offset: int) -> dict:
+        return await self._get("games", name=name, embed="categories", max=PAGE_SIZE, offset=offset)
+
+    async def search_games(self, name: str) -> list:
+        """
+        Searches for games by name, with their categories embedded
+
+        The first page is fetched alone since it almost always holds every
+        result. If it is full, the following pages are fetched in parallel
+        batches until a short page comes back.
+
+        :param name: name of the game to search for
+        :return: list of game objects
+        """
+
+        async def fetch():
+            r = await self._search_page(name, 0)
+            results = list(r["data"])
+            offset = PAGE_SIZE
+            last_page = r
+            while len(last_page["data"]) == PAGE_SIZE:
+                pages = await asyncio.gather(
+                    *[
+                        self._search_page(name, offset + i * PAGE_SIZE)
+                        for i in range(PAGE_FANOUT)
+                    ]
+                )
+                for page in pages:
+                    results.extend(page["data"])
+                    last_page = page
+                    if len(page["data"]) < PAGE_SIZE:
+                        break
+                offset += PAGE_FANOUT * PAGE_SIZE
+            # Results already have their categories, so get_game won't need the API
+            for game in results:
+                self.caches["games"].set(("game", game["id"]), game)
+            return results
+
+        return await self.caches["games"].get_or_fetch(("search", name.lower()), fetch)
+
+    async def get_game(self, game_id: str) -> dict:
+        """
+        Gets a game by ID, with its categories embedded
+
+        :param game_id: speedrun.com game ID
+        :return: game object
+        """
+
+        async def fetch():
+            return (await self._get(f"games/{game_id}", embed="categories"))["data"]
+
+        return await self.caches["games"].get_or_fetch(("game", game_id), fetch)
+
+    async def list_games(self, offset: int = 0) -> list:
+        """
+        Lists games in bulk mode (ID, names and abbreviation only), newest first
+
+        :param offset: number of games to skip
+        :return: list of compact game objects
+        """
+        r = await self._get(
+            "games",
+            _bulk="yes",
+            max=BULK_PAGE_SIZE,
+            orderby="created",
+            direction="desc",
+            offset=offset,
+        )
+        return r["data"]
+
+    async def get_leaderboard(self, game_id: str, category_id: str, top: int = 1) -> dict:
+        """
+        Gets the top runs of a full-game category, with the players embedded
+
+        :param game_id: speedrun.com game ID
+        :param category_id: speedrun.com category ID
+        :param top: number of places to return
+        :return: leaderboard object
+        """
+
+        async def fetch():
+            r = await self._get(
+                f"leaderboards/{game_id}/category/{category_id}", top=top, embed="players"
+            )
+            return r["data"]
+
+        return await self.caches["leaderboards"].get_or_fetch((game_id, category_id, top), fetch)
+
+    @property
+    def stats(self) -> dict:
+        return {name: cache.stats for name, cache in self.caches.items()}
+
+
+class GameIndex(TitleCatalog):
+    """
+    Locally persisted index of speedrun.com game names and abbreviations
+
+    Args:
+        path (str): JSON file the index is saved to
+    """
+
+    @staticmethod
+    def titles(game: dict) -> list:
+        return [game["name"], game.get("abbreviation")]
+
+    async def refresh(self, client: SpeedrunClient):
+        """
+        Brings the index up to date
+
+        Games are listed newest first, so an incremental refresh stops at the
+        first page that has a game we already know. Once a week (or if the
+        first build never finished) the whole list is walked again to pick
+        up renamed games and drop deleted ones, and the index is rebuilt
+        from it off the event loop.
+
+        :param client: the SpeedrunClient to list games with
+        """
+        async with self.lock:
+            full = (
+                not self.state.get("complete")
+                or time.time() - self.state.get("full_refreshed_at", 0) > FULL_REFRESH_INTERVAL
+            )
+            offset = 0
+            seen = {}
+            while True:
+                page = await client.list_games(offset)
+                known = any(game["id"] in self.entries for game in page)
+                for game in page:
+                    entry = {
+                        "name": game["names"]["international"],
+                        "abbreviation": game.get("abbreviation"),
+                    }
+                    if full:
+                        seen[game["id"]] = entry
+                    else:
+                        self.set(game["id"], entry)
+                offset += len(page)
+                if len(page) < BULK_PAGE_SIZE or (known and not full):
+                    break
+            if full:
+                await self.rebuild(seen)
+                self.state.update({"complete": True, "full_refreshed_at": time.time()})
+            await asyncio.to_thread(self.save)
+            logger.info(f"Speedrun game index refreshed, {len(self.entries)} games")
+
+    def name(self, game_id: str) -> str:
+        return self.entries[game_id]["name"]
+
+
+def parse_record_query(search: str) -> Tuple[str, Optional[str], int]:
+    """
+    Splits a !record search into its parts
+
+    The game can be followed by a category and a "top N", separated by |.
+    ie. "Super Mario 64 | 16 Star | top 3"
+
+    :param search: the user's search
+    :return: a tuple of the game, the category or None, and how many runs to show
+    """
+    parts = [part.strip() for part in search.split("|")]
+    category = None
+    top = 1
+    for part in parts[1:]:
+        top_match = re.fullmatch(r"top\s*(\d+)", part, re.IGNORECASE)
+        if top_match:
+            top = max(1, min(int(top_match.group(1)), MAX_TOP))
+        elif part:
+            category = part
+    return parts[0], category, top
+
+
+def find_category(game: dict, name: Optional[str] = None) -> Optional[dict]:
+    """
+    Finds a full-game category in a game object with embedded categories
+
+    Without a name, the first Any% category is used.
+
+    :param game: game object from search_games
+    :param name: category to look for
+    :return: the category object or None
+    """
+    categories = [
+        category for category in game["categories"]["data"] if category["type"] == "per-game"
+    ]
+    if not name:
+        return next((c for c in categories if c["name"].startswith("Any%")), None)
+    name = name.lower()
+    for matches in (
+        lambda c: c["name"].lower() == name,
+        lambda c: c["name"].lower().startswith(name),
+        lambda c: name in c["name"].lower(),
+    ):
+        category = next((c for c in categories if matches(c)), None)
+        if category:
+            return category
+    return None
+
+
+def format_runs(leaderboard: dict) -> list:
+    """
+    Turns a leaderboard with embedded players into (place, time, players) tuples
+    """
+    names = {}
+    for player in leaderboard["players"]["data"]:
+        if player.get("rel") == "guest":
+            names[player["name"]] = player["name"]
+        else:
+            names[player["id"]] = player["names"]["international"]
+
+    runs = []
+    for entry in leaderboard["runs"]:
+        run = entry["run"]
+        time = run["times"]["primary"][2:]
+        players = ", ".join(
+            names.get(player.get("id") or player.get("name"), "someone")
+            for player in run["players"]
+        )
+        runs.append((entry["place"], time, players))
+    return runs
@@ -0,0 +1,186 @@
+"""
+Easter egg triggers for Honkbot.eastereggs.
+
+Every message the bot can see goes through the triggers, and almost none
+of them fire one. So each trigger names keywords, plain text at least one
+of which is in every message it fires on, and the keywords of a channel's
+enabled triggers are compiled into a single alternation that rejects a
+message in one pass over its lowercased text. Literal alternations are far
+cheaper to scan for than the triggers' own patterns, which are only
+checked for messages that pass.
+
+Which triggers are enabled can be set for everywhere, per guild and per
+channel, in a JSON file (data/triggers.json unless TRIGGERS_PATH says
+otherwise):
+
+    {
+        "triggers": {"*": true},
+        "guilds": {
+            "GUILD_ID": {
+                "triggers": {"buzzer": false},
+                "channels": {"CHANNEL_ID": {"triggers": {"*": false, "honk": true}}}
+            }
+        }
+    }
+
+A trigger's own name beats "*", and a channel beats its guild, which beats
+the top level. Triggers are enabled unless something says otherwise.
+"""
+
+import json
+import logging
+import os
+import re
+from typing import Callable, Dict, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+ALL = "*"
+
+
+class Trigger:
+    """
+    An easter egg: a response sent when a message matches a pattern
+
+    Args:
+        name (str): Name used in the config
+        pattern (str): Regular expression searched for in the lowercased message
+        response (str or callable): The response, or a function making it from the message
+        keywords (list): Text at least one of which every match contains. Without
+            keywords, the pattern itself is scanned for
+    """
+
+    def __init__(
+        self, name: str, pattern: str, response: Union[str, Callable], keywords: Optional[List[str]] = None
+    ):
+        self.name = name
+        self.pattern = re.compile(pattern)
+        self.response = response
+        self.keywords = keywords
+
+    @property
+    def prefilter(self) -> str:
+        if self.keywords:
+            return "|".join(re.escape(keyword) for keyword in self.keywords)
+        return f"(?:{self.pattern.pattern})"
+
+    def respond(self, message) -> str:
+        if callable(self.response):
+            return self.response(message)
+        return self.response
+
+
+TRIGGERS = [
+    Trigger(
+        "honk",
+        r"honk",
+        keywords=["honk"],
+        response=lambda message: "beep" if "Skeeter" in message.author.display_name else "HONK!",
+    ),
+    Trigger(
+        "izakaya",
+        r"(?:^|\s)izakaya(?:\s|$)",
+        keywords=["izakaya"],
+        response="Izakaya, an anime-themed restaurant and bar offering pizza, spirits, Korean corn dogs "
+        + "and Japanese pop culture, located at Fairfield Commons Mall in Beavercreek, Ohio?",
+    ),
+    Trigger("dygma", r"dygma", keywords=["dygma"], response="whats dygma"),
+    Trigger(
+        "buzzer",
+        r"(?:s?he|they)\s.+\son\smy\s.+\still?\si",
+        keywords=["til"],
+        response="# [𝐄𝐗𝐓𝐑𝐄𝐌𝐄𝐋𝐘 𝐋𝐎𝐔𝐃 𝐈𝐍𝐂𝐎𝐑𝐑𝐄𝐂𝐓 𝐁𝐔𝐙𝐙𝐄𝐑]",
+    ),
+]
+
+
+class Matcher:
+    """
+    The enabled triggers of a channel, with their keywords compiled into one pattern
+    """
+
+    def __init__(self, triggers: List[Trigger]):
+        self.triggers = triggers
+        self.combined = re.compile("|".join(trigger.prefilter for trigger in triggers)) if triggers else None
+
+    def match(self, content: str) -> List[Trigger]:
+        """
+        Finds the triggers a lowercased message fires, in the order they are listed
+        """
+        if self.combined is None or not self.combined.search(content):
+            return []
+        # The one pass above only says something might fire
+        return [trigger for trigger in self.triggers if trigger.pattern.search(content)]
+
+
+class TriggerEngine:
+    """
+    Finds the easter eggs a message fires, with the triggers enabled where it was sent
+
+    Args:
+        triggers (list): Every Trigger there is
+        config (dict): Which triggers are enabled where, see the module docstring
+    """
+
+    def __init__(self, triggers: List[Trigger] = None, config: Optional[dict] = None):
+        self.triggers = TRIGGERS if triggers is None else triggers
+        self.config = config or {}
+        # Matcher by (guild ID, channel ID), built the first time a channel gets a message.
+        # Channels with the same triggers enabled share one
+        self._matchers: Dict[tuple, Matcher] = {}
+        self._compiled: Dict[tuple, Matcher] = {}
+
+    @classmethod
+    def load(cls, path: str, triggers: List[Trigger] = None) -> "TriggerEngine":
+        """
+        Creates an engine configured from a JSON file. Without the file, every trigger is enabled everywhere
+        """
+        config = {}
+        if os.path.exists(path):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    config = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Could not read trigger config {path}, enabling every trigger: {e!r}")
+        return cls(triggers, config)
+
+    def _scopes(self, guild_id: Optional[int], channel_id: Optional[int]) -> List[dict]:
+        # Trigger settings from the least to the most specific
+        scopes = [self.config.get("triggers", {})]
+        guild = self.config.get("guilds", {}).get(str(guild_id), {}) if guild_id is not None else {}
+        scopes.append(guild.get("triggers", {}))
+        scopes.append(guild.get("channels", {}).get(str(channel_id), {}).get("triggers", {}))
+        return scopes
+
+    def enabled(self, guild_id: Optional[int], channel_id: Optional[int]) -> List[Trigger]:
+        """
+        Gets the triggers enabled in a channel. DMs only follow the top level settings
+        """
+        scopes = self._scopes(guild_id, channel_id)
+        enabled = []
+        for trigger in self.triggers:
+            on = True
+            for scope in scopes:
+                on = scope.get(trigger.name, scope.get(ALL, on))
+            if on:
+                enabled.append(trigger)
+        return enabled
+
+    def matcher(self, guild_id: Optional[int], channel_id: Optional[int]) -> Matcher:
+        key = (guild_id, channel_id)
+        matcher = self._matchers.get(key)
+        if matcher is None:
+            enabled = self.enabled(guild_id, channel_id)
+            names = tuple(trigger.name for trigger in enabled)
+            if names not in self._compiled:
+                self._compiled[names] = Matcher(enabled)
+            matcher = self._matchers[key] = self._compiled[names]
+        return matcher
+
+    def responses(self, message) -> List[str]:
+        """
+        Gets the responses a discord.Message fires, in the order the triggers are listed
+        """
+        guild_id = message.guild.id if message.guild else None
+        matcher = self.matcher(guild_id, message.channel.id)
+        return [trigger.respond(message) for trigger in matcher.match(message.content.lower())]
@@ -1,292 +1,491 @@
 """
 Honkbot database models
 
-This module is used to interact with a PostgreSQL database.
+This module is used to interact with a PostgreSQL database (or SQLite, for
+development and load testing).
 
 Usage:
     import models
-    user = models.DDRCode("MyDiscordID")
-    print(user.name) # Returns the stored name of the user
-    user.create(name="TEST", code="1234-5678", rank="9dan")
-    user.update(code="8888-8888")
-    user.update(name="TESTING", rank="10dan")
-    user.delete()
+    with models.RivalCode("ddr", "MyDiscordID") as user:
+        print(user.name) # Returns the stored name of the user
+        user.create(name="TEST", code="1234-5678", rank="9dan")
+        user.update(code="8888-8888")
+        user.update(name="TESTING", rank="10dan")
+        user.delete()
+    print(models.user_codes("MyDiscordID")) # Every code of the user, in one lookup
+    print(models.roster("ddr", ["MyDiscordID", "AnotherID"])) # DDR codes of a group of users
+
+Every game codes are kept for is registered in GAMES, with the rules its
+names, codes and ranks follow. Adding a game only takes adding it there.
+
+Models store entries through a backend from storage.py, shared by the
+whole process: Postgres unless RIVALS_BACKEND says otherwise, with the
+settings given to configure() (or read from the environment). Every
+operation is a single statement. Entries and searches are cached in the
+process and refreshed on every write, so most lookups never reach the
+database.
+
+From a coroutine, use the async versions so queries run on the database
+executor instead of blocking the event loop:
+    async with await models.RivalCode.load("ddr", "MyDiscordID") as user:
+        await user.acreate(name="TEST", code="1234-5678", rank="9dan")
+        await user.aupdate(code="8888-8888")
 
 It assumes the database is to look like this:
 
 DB: honkbot
-  Table: ddr_codes
+  Table: rival_codes
     user_id: PRIMARY VARCHAR(100)
-    name: VARCHAR(8) NOT NULL (ie. MEATBEAN)
-    code: VARCHAR(9) NOT NULL (ie. 1234-5678)
-    rank: VARCHAR(5) (ie. 10dan, 2kyu, chuu, kai)
-  Table: iidx_codes
-    user_id: PRIMARY VARCHAR(100)
-    name: VARCHAR(6) NOT NULL (ie. SPOOKY)
-    code: VARCHAR(9) NOT NULL (ie. 1234-5678)
-    rank: VARCHAR(5) (ie. 10dan, 2kyu, chuu, kai)
+    game: PRIMARY VARCHAR(16) (ie. ddr, iidx)
+    name: VARCHAR(16) NOT NULL (ie. MEATBEAN)
+    code: VARCHAR(32) NOT NULL (ie. 1234-5678)
+    rank: VARCHAR(8) (ie. 10dan, 2kyu, chuu, kai)
+
+Codes still in the per game tables used before (ddr_codes, iidx_codes)
+are copied into rival_codes by ensure_schema().
 
 """
 
-import os
+import asyncio
+import functools
+import logging
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import settings
+import storage
+from bots.cache import TTLCache
 
-import dotenv
-import psycopg2
+logger = logging.getLogger(__name__)
 
+DAN_RANKS = r"^((10|[1-9])(DAN|KYU)|CHUU|KAI)$"
 
-class CodeDatabaseModel:
+
+class Game:
     """
-    Base model inherited to interact with the different tables in the database
+    Rules of a game's rival codes. Every entry follows them, whether it comes from a command or an import
 
     Args:
-        table (str): Name of the database table to interact with
+        key (str): Short name stored with the game's codes, also the command prefix (ie. "ddr" for !ddrrival)
+        title (str): Name shown to users
+        name_label (str): What the game calls a player name
+        name_length (int): Longest name the game allows
+        code_label (str): What the game calls a player ID
+
+    Optional:
+        code_pattern (str): Regular expression player IDs match
+        code_format (str): What a player ID looks like, for error messages
+        rank_pattern (str): Regular expression uppercased ranks match
+        rank_help (str): The ranks there are, for error messages
+        legacy_table (str): Table the game's codes were kept in before rival_codes
+    """
+
+    def __init__(
+        self,
+        key,
+        title,
+        name_label,
+        name_length,
+        code_label,
+        code_pattern=r"^[0-9]{4}-[0-9]{4}$",
+        code_format="####-####",
+        rank_pattern=DAN_RANKS,
+        rank_help="#dan, #kyu, chuu, or kai",
+        legacy_table=None,
+    ):
+
+        self.key = key
+        self.title = title
+        self.name_label = name_label
+        self.name_length = name_length
+        self.code_label = code_label
+        self.code_pattern = re.compile(code_pattern)
+        self.code_format = code_format
+        self.rank_pattern = re.compile(rank_pattern)
+        self.rank_help = rank_help
+        self.legacy_table = legacy_table
+
+    def validate(self, name, code, rank=None):
+        """
+        Checks a new entry's values against the game's rules
+
+        Args:
+            name (str): Uppercased player name
+            code (str): Player ID
+
+        Optional:
+            rank (str): Uppercased rank
 
+        Returns:
+            str: What is wrong with the entry, or None if it is valid
+        """
+
+        if not name or len(name) > self.name_length:
+            return f"{self.name_label} must be at most {self.name_length} characters!"
+        if not code or not self.code_pattern.search(code):
+            return f"{self.code_label} must follow the following format: `{self.code_format}`"
+        if rank and not self.rank_pattern.search(rank):
+            return f"Rank is not valid! Options are {self.rank_help}"
+        return None
+
+
+# Games rival codes are kept for, by key
+GAMES = {
+    game.key: game
+    for game in [
+        Game("ddr", "DDR", "Dancer name", 8, "DDR ID", legacy_table="ddr_codes"),
+        Game("iidx", "IIDX", "DJ name", 6, "IIDX ID", legacy_table="iidx_codes"),
+    ]
+}
+
+_settings = None
+_backend = None
+_executor = None
+# Threads beyond what the backend can run at once. With every thread waiting
+# on the pool for a connection, the calls that hand one back still get a
+# thread instead of queueing behind them until PoolTimeout
+SPARE_WORKERS = 4
+_backend_lock = threading.Lock()
+
+
+def configure(config):
     """
+    Sets the settings the storage backend is created with. Call it before the first query
 
-    def __init__(self, table=None):
+    Args:
+        config (settings.Settings): The bot's settings
+    """
 
-        self.AVAILABLE_ATTRIBUTES = ["name", "code", "rank"]
+    global _settings
+    with _backend_lock:
+        _settings = config
 
-        dotenv.load_dotenv()
-        self.name = None
-        self.code = None
-        self.rank = None
-        self.table = table
-        self._conn = psycopg2.connect(
-            dbname="honkbot",
-            user=os.getenv("POSTGRES_USER"),
-            password=os.getenv("POSTGRES_PASSWORD"),
-            host=os.getenv("POSTGRES_HOST"),
-            port=os.getenv("POSTGRES_PORT"),
-        )
-        self._cursor = self._conn.cursor()
 
-    def __enter__(self):
-        return self
+def apply_settings(config):
+    """
+    Takes up settings that changed while running, ie. rotated database credentials,
+    keeping the backend, its connections and the caches
 
-    def __exit__(self, exc_type, exc_value, traceback):
+    Args:
+        config (settings.Settings): The new settings
+    """
 
-        self._cursor.close()
-        self._conn.close()
-        return bool(exc_type is None)
+    global _settings
+    with _backend_lock:
+        _settings = config
+        backend = _backend
+    if backend is not None:
+        backend.apply_settings(config)
 
-    def _create_entry(self, table, user_id, **kwargs):
 
-        name = kwargs.get("name")
-        code = kwargs.get("code")
-        rank = kwargs.get("rank")
+def get_backend():
+    """
+    Gets the storage backend shared by every model in the process, creating it on first use
 
-        if not name or not code:
-            raise Exception("Name and code are required attributes")
-        self._cursor.execute(
-            f"INSERT INTO {table} (user_id, name, code, rank) VALUES (%s, %s, %s, %s);",
-            (user_id, name, code, rank),
-        )
-        self._conn.commit()
+    Returns:
+        storage.StorageBackend: The backend picked by the rivals_backend setting
+    """
 
-    def _get_entry(self, table, user_id):
+    global _backend, _settings
+    with _backend_lock:
+        if _backend is None:
+            if _settings is None:
+                _settings = settings.Settings.from_env()
+            _backend = storage.from_settings(_settings)
+        return _backend
 
-        self._cursor.execute(f"SELECT * from {table} WHERE user_id=%s;", (user_id,))
-        entry = self._cursor.fetchone()
-        if entry:
-            return entry
-        else:
-            return (user_id, None, None, None)
 
-    def _list_entries(self, table):
+def set_backend(backend):
+    """
+    Replaces the storage backend, ie. with a storage.SQLiteBackend for load tests
 
-        self._cursor.execute(f"SELECT * FROM {table}")
-        return self._cursor.fetchall()
+    Args:
+        backend (storage.StorageBackend): The backend to use from now on
+    """
 
-    def _search_entries(self, table, **filters):
+    global _backend
+    with _backend_lock:
+        _backend = backend
+    with _cache_lock:
+        ENTRIES.clear()
+        SEARCHES.clear()
+        USER_CODES.clear()
 
-        search_string = " AND ".join([f"{item[0]} = '{item[1].upper()}'" for item in list(filters.items())])
-        self._cursor.execute(f"SELECT * from {table} WHERE {search_string};")
-        response = self._cursor.fetchall()
 
-        return response
+def get_executor():
+    """
+    Gets the thread pool database calls run on, a few threads more than calls the backend can run at once
 
-    def _update_entry(self, table, user_id, **kwargs):
+    Returns:
+        ThreadPoolExecutor: The shared executor
+    """
 
-        entry = self._get_entry(table, user_id)
-        if not entry[1]:
-            raise Exception(f"Entry for user_id {user_id} not found. Entry must be created first")
+    global _executor
+    backend = get_backend()
+    with _backend_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=backend.concurrency + SPARE_WORKERS,
+                thread_name_prefix="honkbot-db",
+            )
+        return _executor
 
-        set_values = ", ".join([f"{item[0]} = '{item[1].upper()}'" for item in list(kwargs.items())])
-        self._cursor.execute(f"UPDATE {table} SET {set_values} WHERE user_id=%s;", (user_id,))
-        self._conn.commit()
 
-    def _delete_entry(self, table, user_id):
+async def run(func, *args, **kwargs):
+    """
+    Runs a blocking database call on the database executor, off the event loop
+
+    Args:
+        func (callable): Function or model method to call
+        *args: Positional arguments for func
+        **kwargs: Keyword arguments for func
 
-        entry = self._get_entry(table, user_id)
-        if not entry[1]:
-            raise Exception(f"Entry for user_id {user_id} not found. Entry must be created first")
+    Returns:
+        Whatever func returns
+    """
 
-        self._cursor.execute(f"DELETE FROM {table} WHERE user_id=%s;", (user_id,))
-        self._conn.commit()
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), functools.partial(func, *args, **kwargs))
 
 
-class DDRCode(CodeDatabaseModel):
+def ensure_schema():
     """
-    Object representing a DDR Dancer
+    Creates the rival table and the indexes searches rely on, if they are missing, then copies
+    in the codes of games still kept in their old tables
+    """
+
+    backend = get_backend()
+    backend.ensure_schema()
+    for game in GAMES.values():
+        if game.legacy_table:
+            copied = backend.migrate_table(game.legacy_table, game.key)
+            if copied:
+                logger.info(f"Copied {copied} {game.title} codes from {game.legacy_table}")
+
+
+# Entries by (game, user_id), including users without one, search results
+# by (game, generation, filters), and every code of a user by user_id. A
+# write replaces its entry, forgets the user's codes, and bumps the game's
+# generation, which retires every cached search of it.
+ENTRIES = TTLCache(ttl=10 * 60, maxsize=10000)
+SEARCHES = TTLCache(ttl=60, maxsize=1000)
+USER_CODES = TTLCache(ttl=10 * 60, maxsize=10000)
+# Generation bumped by writes to any game, guarding USER_CODES
+ANY_GAME = "*"
+_generations = {}
+_cache_lock = threading.Lock()
+_MISSING = object()
+
+
+def _read_through(cache, key, game, load):
+    # A result loaded while the game was written to is returned but not kept
+    with _cache_lock:
+        value = cache.get(key, _MISSING)
+        generation = _generations.get(game, 0)
+    if value is not _MISSING:
+        return value
+    value = load()
+    with _cache_lock:
+        if _generations.get(game, 0) == generation:
+            cache.set(key, value)
+    return value
+
+
+def _written(game, entry):
+    with _cache_lock:
+        for generation in (game, ANY_GAME):
+            _generations[generation] = _generations.get(generation, 0) + 1
+        ENTRIES.set((game, entry[0]), entry)
+        USER_CODES.invalidate(entry[0])
+
+
+def cache_stats():
+    """
+    Gets the hit rates of the rival caches
+
+    Returns:
+        dict: TTLCache stats by cache name
+    """
+
+    with _cache_lock:
+        return {"entries": ENTRIES.stats, "searches": SEARCHES.stats, "user codes": USER_CODES.stats}
+
+
+def user_codes(user_id):
+    """
+    Gets every code a user has, across games, in one lookup
 
     Args:
         user_id (str): Discord User ID to reference
+
+    Returns:
+        List: (game, name, code, rank) of each of the user's codes, ordered by game
     """
 
-    def __init__(self, user_id=None):
-        self.user_id = user_id
-        super().__init__("ddr_codes")
-        _, self.name, self.code, self.rank = self._get_entry(self.table, self.user_id)
+    return list(
+        _read_through(
+            USER_CODES,
+            user_id,
+            ANY_GAME,
+            lambda: [tuple(row) for row in get_backend().user_codes(user_id)],
+        )
+    )
 
-    def create(self, name=None, code=None, rank=None):
-        """
-        Creates a DDR Dancer in the database
 
-        Args:
-            name (str): 8 character dancer name submitted to eAmuse
-            code (str): 9 character dancer ID (####-####)
+def roster(game, user_ids, limit=25, after=None):
+    """
+    Gets the codes a group of users have for a game, a page at a time, in one query
 
-        Optional:
-            rank (str): Dan ranking of user
+    Args:
+        game (str): Key of the game in GAMES
+        user_ids (list): Discord User IDs to reference, ie. the members of a role
+        limit (int): Most entries to return
+        after (tuple): (name, user_id) of the last entry of the previous page
 
-        Returns:
-            None
-        """
-        if not name or len(name) > 8:
-            raise Exception("A dancer name with at most 8 characters is required when creating a new entry")
-        if not code:
-            raise Exception("A DDR code (####-####) is required when creating a new entry")
+    Returns:
+        List: Entries of the users, ordered by name
+    """
 
-        entry = self._get_entry(self.table, self.user_id)
-        if entry[1]:
-            raise Exception("An entry already exists for user")
-        self._create_entry(self.table, self.user_id, name=name, code=code, rank=rank)
-        _, self.name, self.code, self.rank = self._get_entry(self.table, self.user_id)
+    if not user_ids:
+        return []
+    return [tuple(row) for row in get_backend().codes_for_users(GAMES[game].key, user_ids, limit=limit, after=after)]
 
-    def search(self, **filters):
-        """
-        Searches database for given filters
 
-        Args:
-            **filters: Data to filter on
+class RivalCode:
+    """
+    Object representing a player's rival code for a game
 
-        Options:
-            name (str): 8 character dancer name submitted to eAmuse
-            code (str): 9 character dancer ID (####-####)
-            rank (str): Dan ranking of user
+    Args:
+        game (str): Key of the game in GAMES
+        user_id (str): Discord User ID to reference
 
-        Returns:
-            List: Entries matching given filters
-        """
+    """
 
-        if not filters.items():
-            return []
+    def __init__(self, game, user_id=None):
 
-        # Validate search filters
-        for key, _ in filters.items():
-            if key not in self.AVAILABLE_ATTRIBUTES:
-                raise Exception(f'"{key}" is not a valid attribute to search for')
+        self.AVAILABLE_ATTRIBUTES = ["name", "code", "rank"]
 
-        return self._search_entries(self.table, **filters)
+        self.game = GAMES[game]
+        self.user_id = user_id
+        self._storage = get_backend()
+        _, self.name, self.code, self.rank = self._get_entry()
 
-    def update(self, **kwargs):
-        """
-        Updates a DDR dancer in the database
+    def __enter__(self):
+        return self
 
-        Args:
-            **kwargs: The data to be updated
+    def __exit__(self, exc_type, exc_value, traceback):
 
-        Options:
-            name (str): 8 character dancer name submitted to eAmuse
-            code (str): 9 character dancer ID (####-####)
-            rank (str): Dan ranking of user
+        self.close()
+        return bool(exc_type is None)
 
-        Returns:
-            None
+    def close(self):
+        """
+        Kept for models used without a with block. The backend only holds a connection during a call
         """
 
-        # If there's nothing to update...well there's nothing to update
-        if not kwargs.items():
-            return
-        for key, _ in kwargs.items():
-            # If something is inputted that shouldn't be, raise
-            if key not in self.AVAILABLE_ATTRIBUTES:
-                raise Exception(f'"{key}" is not a valid attribute to update')
-
-        self._update_entry(self.table, self.user_id, **kwargs)
-        _, self.name, self.code, self.rank = self._get_entry(self.table, self.user_id)
-
-    def delete(self):
+    @classmethod
+    async def load(cls, *args):
         """
-        Deletes a DDR dancer from the database
+        Creates a model without blocking the event loop
 
         Args:
-            None
+            *args: Arguments of the model (ie. game and user_id of a RivalCode, user_id of a DDRCode)
 
         Returns:
-            None
+            RivalCode: The loaded model. Use it with "async with"
         """
 
-        self._delete_entry(self.table, self.user_id)
-        self.name = None
-        self.code = None
-        self.rank = None
+        return await run(cls, *args)
 
+    async def __aenter__(self):
+        return self
 
-class IIDXCode(CodeDatabaseModel):
-    """
-    Object representing a IIDX player
+    async def __aexit__(self, exc_type, exc_value, traceback):
 
-    Args:
-        user_id (str): Discord User ID to reference
-    """
+        await self.aclose()
+        return bool(exc_type is None)
 
-    def __init__(self, user_id=None):
-        self.user_id = user_id
-        super().__init__("iidx_codes")
+    async def aclose(self):
+        self.close()
 
-        _, self.name, self.code, self.rank = self._get_entry(self.table, self.user_id)
+    async def acreate(self, **kwargs):
+        return await run(self.create, **kwargs)
+
+    async def asearch(self, **filters):
+        return await run(self.search, **filters)
+
+    async def aupdate(self, **kwargs):
+        return await run(self.update, **kwargs)
+
+    async def adelete(self):
+        return await run(self.delete)
+
+    def _get_entry(self):
+
+        return _read_through(ENTRIES, (self.game.key, self.user_id), self.game.key, self._fetch_entry)
+
+    def _fetch_entry(self):
+
+        entry = self._storage.get(self.game.key, self.user_id)
+        if entry:
+            return tuple(entry)
+        else:
+            return (self.user_id, None, None, None)
+
+    def _set_entry(self, entry):
+
+        _written(self.game.key, entry)
+        _, self.name, self.code, self.rank = entry
 
     def create(self, name=None, code=None, rank=None):
         """
-        Creates a IIDX player in the database
+        Creates the player's entry for the game in the database
 
         Args:
-            name (str): DJ Name of the player
-            code (str): IIDX ID of the player
+            name (str): Player name submitted to eAmuse
+            code (str): Player ID (ie. ####-####)
+
         Optional:
             rank (str): Dan ranking of the player
 
         Returns:
             None
         """
-        if not name or len(name) > 6:
-            raise Exception("A DJ name with at most 6 characters is required when creating a new entry")
+        game = self.game
+        if not name or len(name) > game.name_length:
+            raise Exception(
+                f"A {game.name_label.lower()} with at most {game.name_length} characters "
+                + "is required when creating a new entry"
+            )
         if not code:
-            raise Exception("A IIDX ID is required when creating a new entry")
-
-        entry = self._get_entry(self.table, self.user_id)
-        if entry[1]:
+            raise Exception(f"A {game.code_label} ({game.code_format}) is required when creating a new entry")
+
+        entry = self._storage.create(game.key, self.user_id, name, code, rank)
+        if not entry:
+            # Whatever was cached for the user is out of date
+            with _cache_lock:
+                ENTRIES.invalidate((game.key, self.user_id))
+                USER_CODES.invalidate(self.user_id)
             raise Exception("An entry already exists for user")
+        self._set_entry(tuple(entry))
 
-        self._create_entry(self.table, self.user_id, name=name, code=code, rank=rank)
-        _, self.name, self.code, self.rank = self._get_entry(self.table, self.user_id)
-
-    def search(self, **filters):
+    def search(self, limit=25, after=None, **filters):
         """
-        Searches database for given filters
+        Searches the game's entries for given filters, a page at a time
 
         Args:
+            limit (int): Most entries to return
+            after (tuple): (name, user_id) of the last entry of the previous page
             **filters: Data to filter on
 
         Options:
-            name (str): 6 character dancer name submitted to eAmuse
-            code (str): 9 character IIDX ID (####-####)
-            rank (str): Dan ranking of user
+            name (str): Start of, or something close to, a player name
+            code (str): Player ID (ie. ####-####)
+            rank (str): Dan ranking of the player
 
         Returns:
-            List: Entries matching given filters
+            List: Entries matching given filters, ordered by name
         """
 
         if not filters.items():
@@ -297,17 +496,24 @@ class IIDXCode(CodeDatabaseModel):
             if key not in self.AVAILABLE_ATTRIBUTES:
                 raise Exception(f'"{key}" is not a valid attribute to search for')
 
-        return self._search_entries(self.table, **filters)
+        game = self.game.key
+        filters = {key: value.upper() for key, value in filters.items() if value is not None}
+        with _cache_lock:
+            key = (game, _generations.get(game, 0), tuple(sorted(filters.items())), limit, after)
+        return list(
+            _read_through(SEARCHES, key, game, lambda: self._storage.search(game, filters, limit=limit, after=after))
+        )
 
     def update(self, **kwargs):
         """
-        Updates a IIDX player in the database
+        Updates the player's entry for the game in the database
 
         Args:
-            kwargs (dict): Data to be updated
+            **kwargs: The data to be updated
+
         Options:
-            name (str): DJ name of the player
-            code (str): IIDX ID of the player
+            name (str): Player name submitted to eAmuse
+            code (str): Player ID (ie. ####-####)
             rank (str): Dan ranking of the player
 
         Returns:
@@ -322,12 +528,16 @@ class IIDXCode(CodeDatabaseModel):
             if key not in self.AVAILABLE_ATTRIBUTES:
                 raise Exception(f'"{key}" is not a valid attribute to update')
 
-        self._update_entry(self.table, self.user_id, **kwargs)
-        _, self.name, self.code, self.rank = self._get_entry(self.table, self.user_id)
+        values = {key: kwargs[key].upper() for key in self.AVAILABLE_ATTRIBUTES if kwargs.get(key) is not None}
+        entry = self._storage.update(self.game.key, self.user_id, **values)
+        if not entry:
+            self._set_entry((self.user_id, None, None, None))
+            raise Exception(f"Entry for user_id {self.user_id} not found. Entry must be created first")
+        self._set_entry(tuple(entry))
 
     def delete(self):
         """
-        Deletes a player from the database
+        Deletes the player's entry for the game from the database
 
         Args:
             None
@@ -336,7 +546,31 @@ class IIDXCode(CodeDatabaseModel):
             None
         """
 
-        self._delete_entry(self.table, self.user_id)
-        self.name = None
-        self.code = None
-        self.rank = None
+        deleted = self._storage.delete(self.game.key, self.user_id)
+        self._set_entry((self.user_id, None, None, None))
+        if not deleted:
+            raise Exception(f"Entry for user_id {self.user_id} not found. Entry must be created first")
+
+
+class DDRCode(RivalCode):
+    """
+    Object representing a DDR Dancer
+
+    Args:
+        user_id (str): Discord User ID to reference
+    """
+
+    def __init__(self, user_id=None):
+        super().__init__("ddr", user_id)
+
+
+class IIDXCode(RivalCode):
+    """
+    Object representing a IIDX player
+
+    Args:
+        user_id (str): Discord User ID to reference
+    """
+
+    def __init__(self, user_id=None):
+        super().__init__("iidx", user_id)
@@ -0,0 +1,145 @@
+"""
+Bulk import and export of eAmuse rival codes
+
+Rows are streamed through Postgres COPY in both directions (or SQLite, with
+RIVALS_BACKEND=sqlite), so neither a table nor a file is ever held in
+memory. Imported rows are checked with
+the same rules as the rival commands, and rows breaking them are reported
+and skipped. An import is a single transaction: it either loads every
+valid row or none of them.
+
+Files are CSV with a user_id,name,code,rank header, or JSONL with one
+object per line with those keys.
+
+Usage:
+    python rivals_io.py export ddr ddr.csv
+    python rivals_io.py export iidx - --format jsonl > iidx.jsonl
+    python rivals_io.py import ddr ddr.csv
+    python rivals_io.py import iidx iidx.jsonl --on-conflict update
+"""
+
+import argparse
+import contextlib
+import csv
+import json
+import os
+import sys
+import time
+
+import models
+import storage
+
+# Longest user_id the table holds
+USER_ID_LENGTH = 100
+
+
+def read_rows(f, file_format):
+    """
+    Reads rows from a CSV or JSONL file
+
+    :return: generator of (line number, dict of column values, or None if the line is not valid)
+    """
+    if file_format == "csv":
+        for number, row in enumerate(csv.DictReader(f), start=2):
+            yield number, row
+        return
+    for number, line in enumerate(f, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield number, row if isinstance(row, dict) else None
+
+
+def clean_rows(rows, game, counts):
+    """
+    Normalizes rows the way the rival commands do and drops the ones breaking the game's rules
+
+    :param rows: rows from read_rows
+    :param game: models.Game the rows are codes for, whose rules are checked
+    :param counts: dictionary counting "accepted" and "rejected" rows
+    :return: generator of (user_id, name, code, rank)
+    """
+    for number, row in rows:
+        if row is None:
+            error = "Not a JSON object"
+        else:
+            user_id = str(row.get("user_id") or "").strip()
+            name = str(row.get("name") or "").strip().upper()
+            code = str(row.get("code") or "").strip()
+            rank = str(row.get("rank") or "").strip().upper() or None
+            if not user_id or len(user_id) > USER_ID_LENGTH:
+                error = f"user_id must be 1 to {USER_ID_LENGTH} characters!"
+            else:
+                error = game.validate(name, code, rank)
+        if error:
+            counts["rejected"] += 1
+            print(f"line {number}: {error}", file=sys.stderr)
+            continue
+        counts["accepted"] += 1
+        yield user_id, name, code, rank
+
+
+@contextlib.contextmanager
+def open_file(path, mode):
+    if path == "-":
+        yield sys.stdin if "r" in mode else sys.stdout
+        return
+    with open(path, mode, encoding="utf-8", newline="") as f:
+        yield f
+
+
+def guess_format(path):
+    return "jsonl" if os.path.splitext(path)[1].lower() in (".jsonl", ".json", ".ndjson") else "csv"
+
+
+def export_game(game, path, file_format):
+    with open_file(path, "w") as f:
+        return models.get_backend().export_rows(game, f, file_format)
+
+
+def import_game(game, path, file_format, on_conflict):
+    counts = {"accepted": 0, "rejected": 0}
+    with open_file(path, "r") as f:
+        rows = clean_rows(read_rows(f, file_format), models.GAMES[game], counts)
+        imported = models.get_backend().import_rows(game, rows, on_conflict)
+    return imported, counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("action", choices=["import", "export"])
+    parser.add_argument("game", choices=list(models.GAMES))
+    parser.add_argument("path", help="file to read or write, - for stdin/stdout")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="defaults to the file's extension, or csv")
+    parser.add_argument(
+        "--on-conflict",
+        choices=list(storage.ON_CONFLICT),
+        default="skip",
+        help="what to do with users already having a code for the game when importing",
+    )
+    args = parser.parse_args()
+    file_format = args.format or guess_format(args.path)
+    try:
+        models.ensure_schema()
+    except Exception as e:
+        print(f"Could not check the table and indexes: {e!r}", file=sys.stderr)
+
+    start = time.perf_counter()
+    if args.action == "export":
+        exported = export_game(args.game, args.path, file_format)
+        print(f"Exported {exported} rows in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+    else:
+        imported, counts = import_game(args.game, args.path, file_format, args.on_conflict)
+        print(
+            f"Imported {imported} of {counts['accepted']} valid rows "
+            + f"({counts['rejected']} rejected) in {time.perf_counter() - start:.1f}s",
+            file=sys.stderr,
+        )
+    models.get_backend().close()
+
+
+if __name__ == "__main__":
+    main()
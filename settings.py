@@ -0,0 +1,138 @@
+"""
+Honkbot settings
+
+Everything the bot is configured with, read from the environment and the
+.env file once, at startup, then handed to the cogs and models that need
+it. Variables set in the environment win over the .env file.
+
+Usage:
+    import settings
+    config = settings.Settings.from_env()
+    print(config.data_dir)
+
+Sending the bot SIGHUP reads the settings again and applies the ones that
+can change while it runs (API keys, database credentials, which easter
+egg triggers are enabled where and the RemyWiki and StepManiaX settings),
+keeping every cache warm. See env.example for the variables.
+"""
+
+import dataclasses
+import os
+
+import dotenv
+
+
+# Values yes/no settings can take
+BOOLEANS = {"true": True, "yes": True, "on": True, "1": True, "false": False, "no": False, "off": False, "0": False}
+
+
+def _setting(default=None, env=None, secret=False):
+    # env is only needed when the variable isn't the field's name in uppercase
+    return dataclasses.field(default=default, repr=not secret, metadata={"env": env})
+
+
+@dataclasses.dataclass(frozen=True)
+class Settings:
+    """
+    Configuration of the bot. Unset and empty variables keep the defaults
+    """
+
+    discord_api_key: str = _setting(secret=True)
+    speedrun_api_key: str = _setting(secret=True)
+    google_api_key: str = _setting(secret=True)
+    data_dir: str = _setting("data", env="HONKBOT_DATA_DIR")
+    # Privileged, so it also has to be turned on in the Discord developer portal
+    discord_members_intent: bool = _setting(False)
+
+    http_limit_per_host: int = _setting(10)
+    http_host_limits: str = _setting()
+
+    outbox_rate: float = _setting(1.0)
+    outbox_burst: int = _setting(5)
+
+    triggers_path: str = _setting()
+
+    remy_url: str = _setting("https://remywiki.com")
+    remy_resolver: str = _setting("api")
+    remy_parse_pool: str = _setting("process")
+    remy_parse_workers: int = _setting(2)
+    smx_url: str = _setting("https://data.stepmaniax.com")
+
+    rivals_backend: str = _setting("postgres")
+    rivals_sqlite_path: str = _setting()
+
+    postgres_host: str = _setting()
+    postgres_port: str = _setting()
+    postgres_user: str = _setting()
+    postgres_password: str = _setting(secret=True)
+    postgres_pool_size: int = _setting(5)
+    postgres_pool_timeout: float = _setting(10.0)
+    postgres_conn_max_age: float = _setting(1800.0)
+
+    @classmethod
+    def from_env(cls, env_file=".env", environ=None):
+        """
+        Reads the settings from the environment and a .env file
+
+        Args:
+            env_file (str): .env file to read, if it exists
+            environ (dict): Variables to use instead of os.environ
+
+        Returns:
+            Settings: The settings
+
+        Raises:
+            ValueError: If a number setting isn't a number, or a yes/no setting isn't one
+        """
+
+        variables = {**dotenv.dotenv_values(env_file), **(os.environ if environ is None else environ)}
+        values = {}
+        for field in dataclasses.fields(cls):
+            variable = field.metadata["env"] or field.name.upper()
+            value = variables.get(variable)
+            if value is None or value == "":
+                continue
+            if field.type is bool:
+                if value.lower() not in BOOLEANS:
+                    raise ValueError(f"{variable} must be true or false, not {value!r}")
+                values[field.name] = BOOLEANS[value.lower()]
+                continue
+            try:
+                values[field.name] = field.type(value)
+            except ValueError:
+                raise ValueError(f"{variable} must be a number, not {value!r}") from None
+        return cls(**values)
+
+    @property
+    def trigger_config_path(self):
+        return self.triggers_path or os.path.join(self.data_dir, "triggers.json")
+
+    @property
+    def sqlite_path(self):
+        return self.rivals_sqlite_path or os.path.join(self.data_dir, "rivals.sqlite3")
+
+    @property
+    def postgres_connect_kwargs(self):
+        """
+        Arguments for psycopg2.connect
+        """
+        return {
+            "dbname": "honkbot",
+            "user": self.postgres_user,
+            "password": self.postgres_password,
+            "host": self.postgres_host,
+            "port": self.postgres_port,
+        }
+
+    def changed(self, other):
+        """
+        Names the settings that differ from another Settings, without their values
+
+        Returns:
+            list: Names of the fields that changed
+        """
+        return [
+            field.name
+            for field in dataclasses.fields(self)
+            if getattr(self, field.name) != getattr(other, field.name)
+        ]
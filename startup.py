@@ -1,14 +1,16 @@
 import asyncio
 import logging
-import dotenv
-import os
+import signal
+import models
 from bots.honkbot import Honkbot
 from bots.google import Googlebot
+from bots.httpclient import HttpClient, parse_host_limits
 from bots.remy import Remybot
 from bots.smxbot import Smxbot
 from bots.codes import EamuseRivals
+from bots.outbox import Outbox, OutboxBot
 from discord import Intents
-from discord.ext.commands import Bot
+from settings import Settings
 import sys
 
 
@@ -17,23 +19,78 @@ async def add_cogs(bot, cog_list):
         await bot.add_cog(cog)
 
 
-if "__main__" in __name__:
+def reload_settings(settings, bot_cogs, logger):
+    """
+    Reads the settings again and hands them to the models and every cog that takes them up
+
+    :param settings: the settings in use
+    :param bot_cogs: the bot's cogs
+    :param logger: logger to report what changed to
+    :return: the new settings, or the old ones if they couldn't be read
+    """
+    try:
+        new_settings = Settings.from_env()
+    except ValueError as e:
+        logger.error(f"Keeping the old settings: {e}")
+        return settings
+    changed = new_settings.changed(settings)
+    if not changed:
+        logger.info("Settings reloaded, nothing changed")
+        return settings
+    models.apply_settings(new_settings)
+    for cog in bot_cogs:
+        if hasattr(cog, "apply_settings"):
+            cog.apply_settings(new_settings)
+    logger.info(f"Settings reloaded, changed: {', '.join(changed)}")
+    # The Discord key and members intent, data directory, HTTP limits and rivals backend are only read at startup
+    return new_settings
+
+
+async def main(discord_bot, http, bot_cogs, settings, logger):
+    # Everything shares the one event loop, so the HTTP session is created
+    # and closed on the same loop the bot runs on
+    def on_sighup():
+        nonlocal settings
+        settings = reload_settings(settings, bot_cogs, logger)
+
+    if hasattr(signal, "SIGHUP"):
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, on_sighup)
+    async with http, discord_bot:
+        await add_cogs(discord_bot, bot_cogs)
+        await discord_bot.start(settings.discord_api_key)
+
+
+# Checked exactly, since the page parsing workers import this as __mp_main__
+if __name__ == "__main__":
     logging.basicConfig(stream=sys.stdout, level=logging.WARN)
     logger = logging.getLogger(__name__)
     logger.setLevel(logging.INFO)
     logger.info("Starting Honkbot...")
 
-    dotenv.load_dotenv()
-    discord_api_key = os.getenv("DISCORD_API_KEY")
-    speedrun_api_key = os.getenv("SPEEDRUN_API_KEY")
-    google_api_key = os.getenv("GOOGLE_API_KEY")
+    settings = Settings.from_env()
+    models.configure(settings)
 
-    intents = Intents(messages=True, message_content=True, guilds=True)
-    discord_bot = Bot(command_prefix="!", intents=intents)
+    http = HttpClient(
+        limit_per_host=settings.http_limit_per_host,
+        host_limits=parse_host_limits(settings.http_host_limits),
+    )
 
-    honkbot = Honkbot(logger, speedrun_api_key, bot=discord_bot)
-    googlebot = Googlebot(logger, google_api_key, bot=discord_bot)
-    bot_cogs = [honkbot, googlebot, Remybot(), Smxbot(), EamuseRivals()]
-    asyncio.run(add_cogs(discord_bot, bot_cogs))
+    # Members are needed to list everyone in a region role, in !roster. The intent is
+    # privileged, so the bot can't connect with it unless the developer portal allows it
+    intents = Intents(
+        messages=True, message_content=True, guilds=True, members=settings.discord_members_intent
+    )
+    # Plain text replies of every cog are queued, coalesced and rate limited per channel
+    outbox = Outbox(rate=settings.outbox_rate, burst=settings.outbox_burst)
+    discord_bot = OutboxBot(outbox, command_prefix="!", intents=intents)
 
-    discord_bot.run(discord_api_key)
+    honkbot = Honkbot(logger, settings, bot=discord_bot, http=http, outbox=outbox)
+    googlebot = Googlebot(logger, settings, bot=discord_bot, http=http)
+    bot_cogs = [
+        honkbot,
+        googlebot,
+        Remybot(http, settings),
+        Smxbot(http, settings),
+        EamuseRivals(),
+    ]
+    asyncio.run(main(discord_bot, http, bot_cogs, settings, logger))
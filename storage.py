@@ -0,0 +1,927 @@
+"""
+Storage backends for rival codes
+
+Models go through a StorageBackend instead of talking to a database
+driver. Every game's codes live in one table keyed by (user_id, game).
+Entries of a game are (user_id, name, code, rank) tuples, and a user's
+codes across games are (game, name, code, rank) tuples.
+
+PostgresBackend is what the bot runs on. SQLiteBackend keeps the table
+in a local file, or in memory, to run the rival commands and load tests
+without a Postgres server. RIVALS_BACKEND picks one (postgres or sqlite).
+"""
+
+import asyncio
+import csv
+import functools
+import io
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from bots.fuzzy import normalize, trigrams
+
+try:
+    import psycopg2
+except ImportError:
+    # Only needed by the Postgres backend
+    psycopg2 = None
+
+logger = logging.getLogger(__name__)
+
+# Names with at least this similarity match a name search, like pg_trgm's % operator
+SIMILARITY_THRESHOLD = 0.3
+ON_CONFLICT = {
+    "skip": "DO NOTHING",
+    "update": "DO UPDATE SET name = excluded.name, code = excluded.code, rank = excluded.rank",
+}
+
+
+@functools.lru_cache(maxsize=65536)
+def _name_trigrams(name):
+    return trigrams(normalize(name))
+
+
+def name_similarity(first, second):
+    """
+    Same as bots.fuzzy.similarity, with the trigrams of recently seen names cached, for table scans
+    """
+    first_grams = _name_trigrams(first)
+    second_grams = _name_trigrams(second)
+    return 2 * len(first_grams & second_grams) / (len(first_grams) + len(second_grams))
+
+
+def like_prefix(value):
+    """
+    Makes a LIKE pattern matching everything starting with a value, taking its wildcards literally
+    """
+    return re.sub(r"([\\%_])", r"\\\1", value) + "%"
+
+
+class StorageBackend:
+    """
+    Interface of a rival code store
+
+    Lookups return None when there is no entry, and writes return the entry
+    as it was stored, or None if nothing was written. Implementations must
+    be safe to call from several threads at once.
+
+    Args:
+        table (str): Table holding every game's codes
+    """
+
+    # Calls the backend can usefully run at once
+    concurrency = 1
+
+    def __init__(self, table="rival_codes"):
+        self.table = table
+
+    def ensure_schema(self):
+        """
+        Creates the table and indexes, if they are missing
+        """
+        raise NotImplementedError
+
+    def migrate_table(self, legacy_table, game):
+        """
+        Copies a game's codes from the table it had before rival_codes, then renames that table
+        to <legacy_table>_migrated so it is only ever copied once
+
+        Returns:
+            int: Entries copied. 0 if there is no such table
+        """
+        raise NotImplementedError
+
+    def drop_table(self):
+        raise NotImplementedError
+
+    def get(self, game, user_id):
+        raise NotImplementedError
+
+    def user_codes(self, user_id):
+        """
+        Returns:
+            list: (game, name, code, rank) of every code the user has, ordered by game
+        """
+        raise NotImplementedError
+
+    def create(self, game, user_id, name, code, rank):
+        """
+        Returns:
+            tuple: The new entry, or None if the user already has one
+        """
+        raise NotImplementedError
+
+    def update(self, game, user_id, name=None, code=None, rank=None):
+        """
+        Changes the values that are not None
+
+        Returns:
+            tuple: The updated entry, or None if the user has none
+        """
+        raise NotImplementedError
+
+    def delete(self, game, user_id):
+        """
+        Returns:
+            bool: If there was an entry to delete
+        """
+        raise NotImplementedError
+
+    def search(self, game, filters, limit=25, after=None):
+        """
+        Finds a game's entries, a page at a time
+
+        Args:
+            game (str): Game to search
+            filters (dict): Uppercased values to match. A name matches names
+                starting with or similar to it, a code or rank only itself
+            limit (int): Most entries to return
+            after (tuple): (name, user_id) of the last entry of the previous page
+
+        Returns:
+            list: Entries, ordered by (name, user_id)
+        """
+        raise NotImplementedError
+
+    def codes_for_users(self, game, user_ids, limit=25, after=None):
+        """
+        Finds the entries of a game belonging to any of a group of users, a page at a time, in one query
+
+        Args:
+            game (str): Game to look in
+            user_ids (list): Users to find, ie. the members of a role
+            limit (int): Most entries to return
+            after (tuple): (name, user_id) of the last entry of the previous page
+
+        Returns:
+            list: Entries, ordered by (name, user_id)
+        """
+        raise NotImplementedError
+
+    def list_entries(self, game):
+        raise NotImplementedError
+
+    def export_rows(self, game, f, file_format):
+        """
+        Writes a game's entries to a file as CSV (with a header) or JSONL, without loading them all
+
+        Returns:
+            int: Rows written
+        """
+        raise NotImplementedError
+
+    def import_rows(self, game, rows, on_conflict="skip"):
+        """
+        Loads a game's rows in one transaction. Of duplicate users in rows, the last one wins
+
+        Args:
+            game (str): Game the rows are codes for
+            rows (iterator): (user_id, name, code, rank) tuples, already validated
+            on_conflict (str): "skip" or "update" users already in the table
+
+        Returns:
+            int: Rows written
+        """
+        raise NotImplementedError
+
+    def apply_settings(self, settings):
+        """
+        Takes up settings that changed while running, ie. rotated database credentials
+        """
+
+    @property
+    def stats(self):
+        return {}
+
+    def close(self):
+        pass
+
+
+class PoolTimeout(Exception):
+    """
+    Raised when no database connection frees up in time
+    """
+
+
+class ConnectionPool:
+    """
+    Bounded, thread-safe pool of psycopg2 connections
+
+    Connections are opened on demand up to max_size and handed back after
+    every use instead of being closed. A connection that has sat idle for a
+    while is checked with a SELECT 1 before it is handed out again, and one
+    older than max_lifetime is closed and replaced, so connections dropped
+    by the server or a restart of Postgres are never used.
+
+    Args:
+        max_size (int): Most connections open at once
+        timeout (float): Seconds to wait for a free connection before raising PoolTimeout
+        max_lifetime (float): Seconds a connection is reused before it is replaced
+        check_after (float): Seconds a connection can be idle before it is checked on checkout
+        autocommit (bool): Open connections in autocommit mode, for single statement writes
+        **connect_kwargs: Arguments for psycopg2.connect
+
+    """
+
+    def __init__(
+        self, max_size=5, timeout=10, max_lifetime=30 * 60, check_after=30, autocommit=False, **connect_kwargs
+    ):
+
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.check_after = check_after
+        self.autocommit = autocommit
+        self.connect_kwargs = connect_kwargs
+        # Connections opened before this are replaced instead of reused
+        self._configured_at = time.monotonic()
+        self._idle = deque()
+        self._opened_at = {}
+        self._prepared = {}
+        self._size = 0
+        self._condition = threading.Condition()
+
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+        self.timeouts = 0
+        self.opened = 0
+        self.recycled = 0
+        self.broken = 0
+
+    def _reserve(self, deadline):
+        # Takes an idle connection, or a free slot to open one in (None)
+        with self._condition:
+            waited = False
+            while not self._idle and self._size >= self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolTimeout(f"No database connection free after {self.timeout} seconds")
+                waited = True
+                self._condition.wait(remaining)
+            if self._idle:
+                return self._idle.pop(), waited
+            self._size += 1
+            return None, waited
+
+    def _healthy(self, conn, returned_at):
+
+        now = time.monotonic()
+        if conn.closed:
+            return False
+        if now - self._opened_at[conn] > self.max_lifetime or self._opened_at[conn] < self._configured_at:
+            self.recycled += 1
+            return False
+        if now - returned_at > self.check_after:
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT 1;")
+                conn.rollback()
+            except psycopg2.Error as e:
+                logger.info(f"Dropping broken database connection: {e!r}")
+                self.broken += 1
+                return False
+        return True
+
+    def _discard(self, conn):
+
+        self._opened_at.pop(conn, None)
+        self._prepared.pop(conn, None)
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        with self._condition:
+            self._size -= 1
+            self._condition.notify()
+
+    def getconn(self):
+        """
+        Checks a connection out of the pool
+
+        Returns:
+            psycopg2.extensions.connection: A working connection. Hand it back with putconn
+
+        Raises:
+            PoolTimeout: If every connection stayed in use for the whole timeout
+            RuntimeError: If called on an event loop, where waiting for a connection would freeze the bot
+        """
+
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        else:
+            raise RuntimeError("Database calls must not block the event loop, run them with models.run")
+        start = time.monotonic()
+        deadline = start + self.timeout
+        waited = False
+        while True:
+            idle, waited_now = self._reserve(deadline)
+            waited = waited or waited_now
+            if idle is None:
+                try:
+                    conn = psycopg2.connect(**self.connect_kwargs)
+                    conn.autocommit = self.autocommit
+                except Exception:
+                    with self._condition:
+                        self._size -= 1
+                        self._condition.notify()
+                    raise
+                self._opened_at[conn] = time.monotonic()
+                self.opened += 1
+                break
+            conn, returned_at = idle
+            if self._healthy(conn, returned_at):
+                break
+            self._discard(conn)
+
+        wait = time.monotonic() - start
+        with self._condition:
+            self.checkouts += 1
+            if waited:
+                self.waits += 1
+            self.wait_time += wait
+            self.max_wait = max(self.max_wait, wait)
+        return conn
+
+    def putconn(self, conn):
+        """
+        Hands a connection back to the pool, rolling back anything left uncommitted
+
+        Args:
+            conn (psycopg2.extensions.connection): Connection from getconn
+        """
+
+        if not conn.closed:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                self.broken += 1
+                conn.close()
+        if conn.closed:
+            return self._discard(conn)
+        with self._condition:
+            self._idle.append((conn, time.monotonic()))
+            self._condition.notify()
+
+    def reconfigure(self, **connect_kwargs):
+        """
+        Opens new connections with other arguments, ie. rotated credentials. Connections already
+        open are replaced the next time they are checked out, rather than all at once
+
+        Args:
+            **connect_kwargs: Arguments for psycopg2.connect
+        """
+
+        with self._condition:
+            self.connect_kwargs = connect_kwargs
+            self._configured_at = time.monotonic()
+
+    def prepared(self, conn):
+        """
+        Gets the names of the statements prepared on a connection, for the caller to add to
+
+        Args:
+            conn (psycopg2.extensions.connection): Connection from getconn
+
+        Returns:
+            set: Names of prepared statements. Forgotten when the connection is closed
+        """
+
+        return self._prepared.setdefault(conn, set())
+
+    @contextmanager
+    def connection(self):
+
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def closeall(self):
+
+        with self._condition:
+            idle = list(self._idle)
+            self._idle.clear()
+        for conn, _ in idle:
+            self._discard(conn)
+
+    @property
+    def stats(self):
+
+        with self._condition:
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "checkouts": self.checkouts,
+                "waits": self.waits,
+                "avg_wait": self.wait_time / self.checkouts if self.checkouts else 0.0,
+                "max_wait": self.max_wait,
+                "timeouts": self.timeouts,
+                "opened": self.opened,
+                "recycled": self.recycled,
+                "broken": self.broken,
+            }
+
+
+class JsonlWriter(io.TextIOBase):
+    """
+    Target for COPY ... TO STDOUT of row_to_json, writing it out as JSONL
+
+    COPY's text format doubles every backslash. JSON never holds raw
+    control characters, so that is the only escape there is to undo.
+    """
+
+    def __init__(self, out):
+        self.out = out
+        self.buffer = ""
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        # Only unescape whole lines, so a chunk never ends halfway through an escape
+        lines, _, self.buffer = (self.buffer + data).rpartition("\n")
+        if lines:
+            self.out.write(lines.replace("\\\\", "\\") + "\n")
+        return len(data)
+
+
+class RowReader(io.TextIOBase):
+    """
+    Source for COPY ... FROM STDIN, turning rows into CSV as COPY asks for them
+
+    Args:
+        rows (iterator): Tuples of column values
+    """
+
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.pending = ""
+        self.line = io.StringIO()
+        self.writer = csv.writer(self.line, lineterminator="\n")
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        chunks = [self.pending]
+        length = len(self.pending)
+        if size < 0 or length < size:
+            for row in self.rows:
+                self.line.seek(0)
+                self.line.truncate()
+                self.writer.writerow(row)
+                chunks.append(self.line.getvalue())
+                length += len(chunks[-1])
+                if 0 <= size <= length:
+                    break
+        data = "".join(chunks)
+        if size < 0:
+            size = len(data)
+        self.pending = data[size:]
+        return data[:size]
+
+
+class PostgresBackend(StorageBackend):
+    """
+    Rival codes in Postgres, through a ConnectionPool
+
+    Every operation is one autocommitted statement, prepared on the server
+    the first time a connection runs it. Searches are prepared per
+    combination of filters, so each gets a plan that can use the indexes:
+    a name matches names starting with it or similar to it (pg_trgm's %
+    operator), backed by a trigram index.
+
+    Args:
+        pool (ConnectionPool): Pool of autocommit connections
+        table (str): Table holding every game's codes
+    """
+
+    STATEMENTS = {
+        "get": "SELECT user_id, name, code, rank FROM {table} WHERE game = $1 AND user_id = $2",
+        "user_codes": "SELECT game, name, code, rank FROM {table} WHERE user_id = $1 ORDER BY game",
+        "create": (
+            "INSERT INTO {table} (game, user_id, name, code, rank) VALUES ($1, $2, $3, $4, $5) "
+            + "ON CONFLICT (user_id, game) DO NOTHING RETURNING user_id, name, code, rank"
+        ),
+        "update": (
+            "UPDATE {table} SET name = COALESCE($3, name), code = COALESCE($4, code), "
+            + "rank = COALESCE($5, rank) WHERE game = $1 AND user_id = $2 RETURNING user_id, name, code, rank"
+        ),
+        "delete": "DELETE FROM {table} WHERE game = $1 AND user_id = $2 RETURNING user_id",
+        # Users are looked up through the primary key, all of them in one array
+        "codes_for_users": (
+            "SELECT user_id, name, code, rank FROM {table} WHERE game = $1 AND user_id = ANY($2) "
+            + "AND (name, user_id) > ($3, $4) ORDER BY name, user_id LIMIT $5::integer"
+        ),
+    }
+    # Parameters that are not text, by statement
+    STATEMENT_TYPES = {"codes_for_users": ["text", "text[]", "text", "text", "text"]}
+    SEARCH_FILTERS = {
+        "name": "(name LIKE {} OR name % {})",
+        "code": "code = {}",
+        "rank": "rank = {}",
+    }
+    SCHEMA = [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        "CREATE TABLE IF NOT EXISTS {table} (user_id VARCHAR(100) NOT NULL, game VARCHAR(16) NOT NULL, "
+        + "name VARCHAR(16) NOT NULL, code VARCHAR(32) NOT NULL, rank VARCHAR(8), PRIMARY KEY (user_id, game))",
+        "CREATE INDEX IF NOT EXISTS {table}_name_trgm ON {table} USING gin (name gin_trgm_ops)",
+        "CREATE INDEX IF NOT EXISTS {table}_game_name_user_id ON {table} (game, name, user_id)",
+        "CREATE INDEX IF NOT EXISTS {table}_game_code ON {table} (game, code)",
+    ]
+    EXPORT_SQL = {
+        "csv": "COPY (SELECT user_id, name, code, rank FROM {table} WHERE game = %s ORDER BY user_id) "
+        + "TO STDOUT WITH (FORMAT csv, HEADER true)",
+        "jsonl": "COPY (SELECT row_to_json(entry) FROM "
+        + "(SELECT user_id, name, code, rank FROM {table} WHERE game = %s ORDER BY user_id) entry) TO STDOUT",
+    }
+    # Imports are copied into a temporary table first, so duplicate users
+    # (the last one wins) and users already in the table can be handled
+    IMPORT_TABLE_SQL = (
+        "CREATE TEMP TABLE rival_import "
+        + "(line bigserial, user_id text, name text, code text, rank text) ON COMMIT DROP"
+    )
+    IMPORT_COPY_SQL = "COPY rival_import (user_id, name, code, rank) FROM STDIN WITH (FORMAT csv)"
+    IMPORT_INSERT_SQL = (
+        "INSERT INTO {table} (user_id, game, name, code, rank) "
+        + "SELECT DISTINCT ON (user_id) user_id, %s, name, code, rank FROM rival_import "
+        + "ORDER BY user_id, line DESC ON CONFLICT (user_id, game) {on_conflict}"
+    )
+
+    def __init__(self, pool, table="rival_codes"):
+        super().__init__(table)
+        self.pool = pool
+        self.concurrency = pool.max_size
+
+    @classmethod
+    def from_settings(cls, settings, table="rival_codes"):
+        if psycopg2 is None:
+            raise RuntimeError("psycopg2 is required for the postgres rivals backend")
+        return cls(
+            ConnectionPool(
+                max_size=settings.postgres_pool_size,
+                timeout=settings.postgres_pool_timeout,
+                max_lifetime=settings.postgres_conn_max_age,
+                autocommit=True,
+                **settings.postgres_connect_kwargs,
+            ),
+            table,
+        )
+
+    def apply_settings(self, settings):
+        if settings.postgres_connect_kwargs != self.pool.connect_kwargs:
+            self.pool.reconfigure(**settings.postgres_connect_kwargs)
+
+    def _execute(self, statement, *params, sql=None, fetch="one"):
+        # Statements are prepared once per connection, then only EXECUTEd
+        with self.pool.connection() as conn, conn.cursor() as cursor:
+            name = f"{self.table}_{statement}"
+            prepared = self.pool.prepared(conn)
+            if name not in prepared:
+                types = ", ".join(self.STATEMENT_TYPES.get(statement, ["text"] * len(params)))
+                sql = (sql or self.STATEMENTS[statement]).format(table=self.table)
+                cursor.execute(f"PREPARE {name} ({types}) AS {sql};")
+                prepared.add(name)
+            placeholders = ", ".join(["%s"] * len(params))
+            cursor.execute(f"EXECUTE {name} ({placeholders});", params)
+            return cursor.fetchone() if fetch == "one" else cursor.fetchall()
+
+    @contextmanager
+    def _transaction(self):
+        with self.pool.connection() as conn:
+            conn.autocommit = False
+            try:
+                with conn, conn.cursor() as cursor:
+                    yield cursor
+            finally:
+                conn.autocommit = True
+
+    def ensure_schema(self):
+        with self.pool.connection() as conn, conn.cursor() as cursor:
+            for statement in self.SCHEMA:
+                cursor.execute(statement.format(table=self.table) + ";")
+
+    def migrate_table(self, legacy_table, game):
+        with self._transaction() as cursor:
+            cursor.execute("SELECT to_regclass(%s);", (legacy_table,))
+            if cursor.fetchone()[0] is None:
+                return 0
+            cursor.execute(
+                f"INSERT INTO {self.table} (user_id, game, name, code, rank) "
+                + f"SELECT user_id, %s, name, code, rank FROM {legacy_table} ON CONFLICT (user_id, game) DO NOTHING;",
+                (game,),
+            )
+            copied = cursor.rowcount
+            cursor.execute(f"ALTER TABLE {legacy_table} RENAME TO {legacy_table}_migrated;")
+            return copied
+
+    def drop_table(self):
+        with self.pool.connection() as conn, conn.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {self.table};")
+
+    def get(self, game, user_id):
+        return self._execute("get", game, user_id)
+
+    def user_codes(self, user_id):
+        return self._execute("user_codes", user_id, fetch="all")
+
+    def create(self, game, user_id, name, code, rank):
+        return self._execute("create", game, user_id, name, code, rank)
+
+    def update(self, game, user_id, name=None, code=None, rank=None):
+        return self._execute("update", game, user_id, name, code, rank)
+
+    def delete(self, game, user_id):
+        return self._execute("delete", game, user_id) is not None
+
+    def search(self, game, filters, limit=25, after=None):
+        conditions = []
+        params = []
+
+        def param(value):
+            params.append(value)
+            return f"${len(params)}"
+
+        conditions.append(f"game = {param(game)}")
+        keys = [key for key in self.SEARCH_FILTERS if key in filters]
+        for key in keys:
+            if key == "name":
+                conditions.append(self.SEARCH_FILTERS[key].format(param(like_prefix(filters[key])), param(filters[key])))
+            else:
+                conditions.append(self.SEARCH_FILTERS[key].format(param(filters[key])))
+        if after:
+            conditions.append(f"(name, user_id) > ({param(after[0])}, {param(after[1])})")
+
+        statement = "search_" + "_".join(keys) + ("_after" if after else "")
+        sql = (
+            "SELECT user_id, name, code, rank FROM {table} "
+            + f"WHERE {' AND '.join(conditions)} "
+            + f"ORDER BY name, user_id LIMIT {param(str(limit))}::integer"
+        )
+        return self._execute(statement, *params, sql=sql, fetch="all")
+
+    def codes_for_users(self, game, user_ids, limit=25, after=None):
+        # Every name sorts after ("", "")
+        after = after or ("", "")
+        return self._execute("codes_for_users", game, list(user_ids), after[0], after[1], str(limit), fetch="all")
+
+    def list_entries(self, game):
+        with self.pool.connection() as conn, conn.cursor() as cursor:
+            cursor.execute(f"SELECT user_id, name, code, rank FROM {self.table} WHERE game = %s;", (game,))
+            return cursor.fetchall()
+
+    def export_rows(self, game, f, file_format):
+        with self.pool.connection() as conn, conn.cursor() as cursor:
+            target = JsonlWriter(f) if file_format == "jsonl" else f
+            sql = cursor.mogrify(self.EXPORT_SQL[file_format].format(table=self.table), (game,)).decode()
+            cursor.copy_expert(sql, target)
+            return cursor.rowcount
+
+    def import_rows(self, game, rows, on_conflict="skip"):
+        with self._transaction() as cursor:
+            cursor.execute(self.IMPORT_TABLE_SQL)
+            cursor.copy_expert(self.IMPORT_COPY_SQL, RowReader(rows))
+            cursor.execute(
+                self.IMPORT_INSERT_SQL.format(table=self.table, on_conflict=ON_CONFLICT[on_conflict]), (game,)
+            )
+            return cursor.rowcount
+
+    @property
+    def stats(self):
+        return self.pool.stats
+
+    def close(self):
+        self.pool.closeall()
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    Rival codes in an embedded SQLite database
+
+    Calls share one connection and take turns. Name searches match
+    prefixes with LIKE and similar names with name_similarity, which
+    scans the game's entries, so this is meant for development and load
+    testing rather than big tables. Needs SQLite 3.35 or newer, for
+    RETURNING.
+
+    Args:
+        path (str): Database file, or ":memory:"
+        table (str): Table holding every game's codes
+    """
+
+    SCHEMA = [
+        "CREATE TABLE IF NOT EXISTS {table} (user_id TEXT NOT NULL, game TEXT NOT NULL, "
+        + "name TEXT NOT NULL, code TEXT NOT NULL, rank TEXT, PRIMARY KEY (user_id, game))",
+        "CREATE INDEX IF NOT EXISTS {table}_game_name_user_id ON {table} (game, name, user_id)",
+        "CREATE INDEX IF NOT EXISTS {table}_game_code ON {table} (game, code)",
+    ]
+    SEARCH_FILTERS = {
+        "name": "(name LIKE ? ESCAPE '\\' OR similarity(name, ?) >= ?)",
+        "code": "code = ?",
+        "rank": "rank = ?",
+    }
+
+    def __init__(self, path=":memory:", table="rival_codes"):
+        super().__init__(table)
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Autocommit, with transactions opened explicitly
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode = WAL;")
+        self._conn.execute("PRAGMA synchronous = NORMAL;")
+        # LIKE is case sensitive in Postgres too
+        self._conn.execute("PRAGMA case_sensitive_like = ON;")
+        self._conn.create_function("similarity", 2, name_similarity, deterministic=True)
+        self._lock = threading.Lock()
+        self.queries = 0
+
+    @classmethod
+    def from_settings(cls, settings, table="rival_codes"):
+        return cls(settings.sqlite_path, table)
+
+    def _execute(self, sql, params=(), fetch="one"):
+        with self._lock:
+            self.queries += 1
+            cursor = self._conn.execute(sql, params)
+            return cursor.fetchone() if fetch == "one" else cursor.fetchall()
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._conn.execute("BEGIN;")
+            try:
+                yield self._conn
+                self._conn.execute("COMMIT;")
+            except BaseException:
+                self._conn.execute("ROLLBACK;")
+                raise
+
+    def ensure_schema(self):
+        with self._lock:
+            for statement in self.SCHEMA:
+                self._conn.execute(statement.format(table=self.table) + ";")
+
+    def migrate_table(self, legacy_table, game):
+        with self._transaction() as conn:
+            exists = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?;", (legacy_table,)
+            ).fetchone()
+            if not exists:
+                return 0
+            copied = conn.execute(
+                f"INSERT INTO {self.table} (user_id, game, name, code, rank) "
+                + f"SELECT user_id, ?, name, code, rank FROM {legacy_table} WHERE TRUE "
+                + "ON CONFLICT (user_id, game) DO NOTHING;",
+                (game,),
+            ).rowcount
+            conn.execute(f"ALTER TABLE {legacy_table} RENAME TO {legacy_table}_migrated;")
+            return copied
+
+    def drop_table(self):
+        with self._lock:
+            self._conn.execute(f"DROP TABLE IF EXISTS {self.table};")
+
+    def get(self, game, user_id):
+        return self._execute(
+            f"SELECT user_id, name, code, rank FROM {self.table} WHERE game = ? AND user_id = ?;", (game, user_id)
+        )
+
+    def user_codes(self, user_id):
+        return self._execute(
+            f"SELECT game, name, code, rank FROM {self.table} WHERE user_id = ? ORDER BY game;", (user_id,), fetch="all"
+        )
+
+    def create(self, game, user_id, name, code, rank):
+        return self._execute(
+            f"INSERT INTO {self.table} (game, user_id, name, code, rank) VALUES (?, ?, ?, ?, ?) "
+            + "ON CONFLICT (user_id, game) DO NOTHING RETURNING user_id, name, code, rank;",
+            (game, user_id, name, code, rank),
+        )
+
+    def update(self, game, user_id, name=None, code=None, rank=None):
+        return self._execute(
+            f"UPDATE {self.table} SET name = COALESCE(?, name), code = COALESCE(?, code), "
+            + "rank = COALESCE(?, rank) WHERE game = ? AND user_id = ? RETURNING user_id, name, code, rank;",
+            (name, code, rank, game, user_id),
+        )
+
+    def delete(self, game, user_id):
+        return (
+            self._execute(
+                f"DELETE FROM {self.table} WHERE game = ? AND user_id = ? RETURNING user_id;", (game, user_id)
+            )
+            is not None
+        )
+
+    def search(self, game, filters, limit=25, after=None):
+        conditions = ["game = ?"]
+        params = [game]
+        for key in self.SEARCH_FILTERS:
+            if key not in filters:
+                continue
+            conditions.append(self.SEARCH_FILTERS[key])
+            if key == "name":
+                params += [like_prefix(filters[key]), filters[key], SIMILARITY_THRESHOLD]
+            else:
+                params.append(filters[key])
+        if after:
+            conditions.append("(name, user_id) > (?, ?)")
+            params += list(after)
+        sql = (
+            f"SELECT user_id, name, code, rank FROM {self.table} "
+            + f"WHERE {' AND '.join(conditions)} ORDER BY name, user_id LIMIT ?;"
+        )
+        return self._execute(sql, params + [limit], fetch="all")
+
+    def codes_for_users(self, game, user_ids, limit=25, after=None):
+        # The users are passed as one JSON array, rather than a parameter
+        # each, which would run into SQLite's limit on parameters
+        after = after or ("", "")
+        return self._execute(
+            f"SELECT user_id, name, code, rank FROM {self.table} "
+            + "WHERE game = ? AND user_id IN (SELECT value FROM json_each(?)) AND (name, user_id) > (?, ?) "
+            + "ORDER BY name, user_id LIMIT ?;",
+            (game, json.dumps(list(user_ids)), after[0], after[1], limit),
+            fetch="all",
+        )
+
+    def list_entries(self, game):
+        return self._execute(
+            f"SELECT user_id, name, code, rank FROM {self.table} WHERE game = ?;", (game,), fetch="all"
+        )
+
+    def export_rows(self, game, f, file_format):
+        count = 0
+        writer = csv.writer(f, lineterminator="\n")
+        if file_format == "csv":
+            writer.writerow(["user_id", "name", "code", "rank"])
+        with self._lock:
+            for row in self._conn.execute(
+                f"SELECT user_id, name, code, rank FROM {self.table} WHERE game = ? ORDER BY user_id;", (game,)
+            ):
+                if file_format == "csv":
+                    writer.writerow(row)
+                else:
+                    f.write(json.dumps(dict(zip(("user_id", "name", "code", "rank"), row))) + "\n")
+                count += 1
+        return count
+
+    def import_rows(self, game, rows, on_conflict="skip"):
+        with self._transaction() as conn:
+            conn.execute(
+                "CREATE TEMP TABLE rival_import "
+                + "(line INTEGER PRIMARY KEY, user_id TEXT, name TEXT, code TEXT, rank TEXT);"
+            )
+            conn.executemany("INSERT INTO rival_import (user_id, name, code, rank) VALUES (?, ?, ?, ?);", rows)
+            imported = conn.execute(
+                f"INSERT INTO {self.table} (user_id, game, name, code, rank) "
+                + "SELECT user_id, ?, name, code, rank FROM rival_import "
+                + "WHERE line IN (SELECT MAX(line) FROM rival_import GROUP BY user_id) "
+                + f"ON CONFLICT (user_id, game) {ON_CONFLICT[on_conflict]};",
+                (game,),
+            ).rowcount
+            conn.execute("DROP TABLE rival_import;")
+            return imported
+
+    @property
+    def stats(self):
+        return {"path": self.path, "queries": self.queries}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+BACKENDS = {"postgres": PostgresBackend, "sqlite": SQLiteBackend}
+
+
+def from_settings(settings):
+    """
+    Creates the backend named by the rivals_backend setting
+
+    Args:
+        settings (settings.Settings): The bot's settings
+
+    Returns:
+        StorageBackend: A PostgresBackend unless told otherwise
+    """
+
+    name = settings.rivals_backend
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown rivals backend {name!r}, expected one of {', '.join(BACKENDS)}")
+    return BACKENDS[name].from_settings(settings)
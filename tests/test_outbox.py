@@ -0,0 +1,117 @@
+"""
+Tests the Outbox's coalescing, rate limiting, priorities and queue eviction
+against channels that record what they were sent.
+
+Usage:
+    python -m unittest tests.test_outbox
+"""
+
+import asyncio
+import time
+import unittest
+from types import SimpleNamespace
+
+from bots.outbox import COMMAND, EASTER_EGG, MAX_LENGTH, Outbox
+
+
+class Channel:
+    def __init__(self, channel_id=1, delay=0):
+        self.id = channel_id
+        self.delay = delay
+        self.sent = []
+
+    async def send(self, content, **kwargs):
+        await asyncio.sleep(self.delay)
+        message = SimpleNamespace(content=content, kwargs=kwargs)
+        self.sent.append(message)
+        return message
+
+    @property
+    def contents(self):
+        return [message.content for message in self.sent]
+
+
+class OutboxTest(unittest.IsolatedAsyncioTestCase):
+    async def test_queued_replies_are_joined(self):
+        outbox = Outbox(rate=10, burst=1)
+        channel = Channel()
+        futures = [outbox.post(channel, content) for content in ("a", "b", "c")]
+        messages = await asyncio.gather(*futures)
+        self.assertEqual(channel.contents, ["a\nb\nc"])
+        self.assertTrue(all(message is channel.sent[0] for message in messages))
+        self.assertEqual(outbox.stats["coalesced"], 2)
+
+    async def test_joined_replies_fit_in_one_message(self):
+        outbox = Outbox(rate=1000, burst=5)
+        channel = Channel()
+        half = "x" * (MAX_LENGTH // 2 - 1)
+        await asyncio.gather(*[outbox.post(channel, half) for _ in range(3)])
+        self.assertEqual([len(content) for content in channel.contents], [len(half) * 2 + 1, len(half)])
+
+    async def test_replies_with_options_are_sent_alone(self):
+        outbox = Outbox(rate=1000, burst=5)
+        channel = Channel()
+        await asyncio.gather(outbox.post(channel, "a"), outbox.post(channel, "b", tts=True), outbox.post(channel, "c"))
+        self.assertEqual(channel.contents, ["a", "b", "c"])
+        self.assertEqual(channel.sent[1].kwargs, {"tts": True})
+
+    async def test_commands_go_first_and_alone(self):
+        outbox = Outbox(rate=1000, burst=5)
+        channel = Channel()
+        egg = outbox.post(channel, "HONK!", EASTER_EGG)
+        command = outbox.post(channel, "WR is 1:23", COMMAND)
+        command_message, egg_message = await asyncio.gather(command, egg)
+        self.assertEqual(channel.contents, ["WR is 1:23", "HONK!"])
+        self.assertEqual(command_message.content, "WR is 1:23")
+        self.assertEqual(egg_message.content, "HONK!")
+
+    async def test_sends_are_throttled(self):
+        outbox = Outbox(rate=20, burst=1)
+        channel = Channel()
+        start = time.monotonic()
+        await outbox.send(channel, "a")
+        await outbox.send(channel, "b")
+        self.assertGreaterEqual(time.monotonic() - start, 0.04)
+        self.assertEqual(channel.contents, ["a", "b"])
+        self.assertEqual(outbox.stats["throttled"], 1)
+
+    async def test_channels_have_their_own_buckets(self):
+        outbox = Outbox(rate=0.1, burst=1)
+        first, second = Channel(1), Channel(2)
+        await asyncio.wait_for(asyncio.gather(outbox.send(first, "a"), outbox.send(second, "b")), 1)
+        self.assertEqual((first.contents, second.contents), (["a"], ["b"]))
+
+    async def test_stale_eggs_are_dropped_without_a_token(self):
+        outbox = Outbox(rate=10, burst=1, stale_after=0.01)
+        channel = Channel()
+        await outbox.send(channel, "a")
+        self.assertIsNone(await outbox.send(channel, "HONK!", EASTER_EGG))
+        self.assertEqual(channel.contents, ["a"])
+        self.assertEqual(outbox.stats["dropped"], 1)
+        # The token waited for was given back
+        start = time.monotonic()
+        await outbox.send(channel, "b")
+        self.assertLess(time.monotonic() - start, 0.05)
+
+    async def test_idle_queues_are_evicted_once_their_bucket_is_full(self):
+        outbox = Outbox(rate=50, burst=2)
+        channel = Channel()
+        await outbox.send(channel, "a")
+        self.assertIn(channel.id, outbox._queues)
+        await asyncio.sleep(0.1)
+        self.assertNotIn(channel.id, outbox._queues)
+        await outbox.send(channel, "b")
+        self.assertEqual(channel.contents, ["a", "b"])
+
+    async def test_close_resolves_waiting_replies(self):
+        outbox = Outbox(rate=0.1, burst=1)
+        channel = Channel(delay=1)
+        sending = outbox.post(channel, "a")
+        await asyncio.sleep(0.01)
+        waiting = outbox.post(channel, "b")
+        outbox.close()
+        self.assertEqual(await asyncio.wait_for(asyncio.gather(sending, waiting), 1), [None, None])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,140 @@
+"""
+Tests the RemyWiki API resolver against a local stand-in for RemyWiki.
+
+The stand-in serves canned action=query and action=parse responses, and
+fails anything the API resolver shouldn't need, ie. the rendered pages.
+
+Usage:
+    python -m unittest tests.test_remy_api
+"""
+
+import tempfile
+import unittest
+
+from aiohttp import web
+
+from bots import remy
+from bots.httpclient import HttpClient
+from bots.pagecache import PageCache
+from settings import Settings
+
+# Songs, what they link to (listed by title, like the API does) and the
+# Gallery link their rendered text starts with
+SONGS = {
+    "MAX 300": {
+        "links": ["Bag Gallery", "DDRMAX", "MAX 300 Gallery"],
+        "text": '<a href="/MAX_300_Gallery">Gallery</a> <a href="/Bag_Gallery">Bag</a>',
+    },
+    "Sakura": {
+        "links": ["Alpha Gallery", "Zeta Gallery"],
+        "text": '<p>See <a href="/Zeta_Gallery" title="Zeta Gallery">the gallery</a>, '
+        + 'and <a href="/Alpha_Gallery">Alpha</a>.</p>',
+    },
+    "Solo": {"links": ["DDRMAX"], "text": "<p>No gallery</p>"},
+}
+
+# Images used on each page
+IMAGES = {
+    "MAX 300": ["File:MAX 300 banner.png"],
+    "MAX 300 Gallery": ["File:MAX 300 jacket.png"],
+    "Bag Gallery": ["File:Bag jacket.png"],
+    "Sakura": [],
+    "Alpha Gallery": ["File:Alpha jacket.png"],
+    "Zeta Gallery": ["File:Zeta jacket.png"],
+    "Solo": ["File:Solo jacket.png"],
+}
+
+
+REQUESTS = web.AppKey("requests", list)
+
+
+def image_url(file_title):
+    return f"https://images.example/{file_title[len('File:'):].replace(' ', '_')}"
+
+
+async def api(request):
+    params = request.query
+    request.app[REQUESTS].append(dict(params))
+    if params.get("action") == "parse":
+        song = SONGS.get(params["page"])
+        if song is None:
+            return web.json_response({"error": {"code": "missingtitle"}})
+        return web.json_response({"parse": {"title": params["page"], "text": song["text"]}})
+
+    title = params.get("titles")
+    if params.get("list") == "search":
+        pages = [{"title": title, "categories": [{"title": "Category:Songs"}]}] if title in SONGS else []
+        search = [{"title": name} for name in SONGS if title.lower() in name.lower()]
+        return web.json_response({"query": {"pages": pages, "search": search[:1]}})
+    if params.get("prop") == "links":
+        links = [{"title": link} for link in sorted(SONGS[title]["links"])]
+        return web.json_response({"query": {"pages": [{"title": title, "links": links}]}})
+    if params.get("generator") == "images":
+        pages = [
+            {"title": file_title, "imageinfo": [{"url": image_url(file_title)}]}
+            for file_title in IMAGES.get(title, [])
+        ]
+        return web.json_response({"query": {"pages": pages}})
+    return web.Response(status=400)
+
+
+async def not_served(request):
+    request.app[REQUESTS].append({"path": request.path})
+    return web.Response(status=404)
+
+
+class RemyApiTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        app = web.Application()
+        app[REQUESTS] = []
+        app.router.add_get("/api.php", api)
+        app.router.add_route("*", "/{path:.*}", not_served)
+        self.requests = app[REQUESTS]
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = self.runner.addresses[0][1]
+
+        self.directory = tempfile.TemporaryDirectory()
+        remy.configure(
+            Settings(remy_url=f"http://127.0.0.1:{port}", remy_parse_pool="thread", data_dir=self.directory.name)
+        )
+        remy.SONG_IMAGES.clear()
+        remy.MISSING_SONGS.clear()
+        self.http = HttpClient()
+        self.pages = PageCache(self.http, self.directory.name)
+
+    async def asyncTearDown(self):
+        await self.http.close()
+        await self.runner.cleanup()
+        remy.configure(Settings())
+        remy.close_parse_pool()
+        self.directory.cleanup()
+
+    async def test_gallery_named_after_the_song_wins(self):
+        song = await remy.query_song_images(self.pages, "max 300")
+        self.assertEqual(song["title"], "MAX 300")
+        self.assertEqual(song["images"]["jacket"], image_url("File:MAX 300 jacket.png"))
+        self.assertEqual(song["images"]["banner"], image_url("File:MAX 300 banner.png"))
+        self.assertFalse([params for params in self.requests if params.get("action") == "parse"])
+
+    async def test_first_gallery_in_the_text_without_a_named_one(self):
+        song = await remy.query_song_images(self.pages, "Sakura")
+        self.assertEqual(song["images"], {"jacket": image_url("File:Zeta jacket.png")})
+
+    async def test_song_without_a_gallery(self):
+        song = await remy.query_song_images(self.pages, "Solo")
+        self.assertEqual(song["images"], {"jacket": image_url("File:Solo jacket.png")})
+
+    async def test_missing_song(self):
+        self.assertIsNone(await remy.query_song_images(self.pages, "Nothing Like It"))
+
+    async def test_get_image_only_uses_the_api(self):
+        response = await remy.get_image(self.pages, "MAX 300", "banner")
+        self.assertEqual(response, image_url("File:MAX 300 banner.png"))
+        self.assertFalse([params for params in self.requests if "path" in params])
+
+
+if __name__ == "__main__":
+    unittest.main()